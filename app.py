@@ -1,45 +1,289 @@
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, g, has_request_context, make_response, abort, session as flask_session
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, SelectField, SubmitField, TextAreaField, PasswordField, IntegerField, FloatField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError  # Added ValidationError
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, date
-from sqlalchemy import func, and_
-from sqlalchemy.exc import PendingRollbackError, IntegrityError, SQLAlchemyError  # Added these
+from sqlalchemy import func, and_, or_, select, update, delete, create_engine, inspect as sa_inspect
+from sqlalchemy import event as sa_event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import joinedload, aliased, Session as OrmSession
+from sqlalchemy.dialects import sqlite as sqlite_dialect, postgresql as postgresql_dialect
+from sqlalchemy.exc import PendingRollbackError, IntegrityError, SQLAlchemyError, OperationalError  # Added these
 import secrets
+import random
+import hashlib
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import heapq
+import threading
+import time
+import json
+from collections import deque, namedtuple
 import os
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 import uuid
-from PIL import Image
+import click
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, features as pil_features
 import io
+import csv
+import re
+import sqlite3
+import socket
+import atexit
+from bisect import bisect_left
 from contextlib import contextmanager  # Added this for db_transaction
+from functools import wraps
 
 load_dotenv()  # Load environment variables from .env file
 
+def normalize_database_url(url):
+    if url and url.startswith('postgres://'):  # scheme used by some hosting providers
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def database_url(name='DATABASE_URL', default='sqlite:///trimq_franchise.db'):
+    """DATABASE_URL, or the local SQLite file for a single-PC shop"""
+    return normalize_database_url(os.environ.get(name, default))
+
+def engine_options(url):
+    """Connection pool settings for the chosen backend; SQLite is tuned per connection instead"""
+    if url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),  # per worker process
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
+
+def parse_branch_database_urls(value):
+    """BRANCH_DATABASE_URLS as {branch code: url}, from 'main=sqlite:///trimq_main.db,downtown=postgresql://...'"""
+    urls = {}
+    for item in value.split(','):
+        code, sep, url = item.partition('=')
+        if sep and code.strip() and url.strip():
+            urls[code.strip()] = normalize_database_url(url.strip())
+    return urls
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///trimq_franchise.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Reports run on their own engine so a month-end report never holds the connections check-ins need:
+# a replica when DATABASE_READ_URL is set, otherwise a separate read-only pool on the primary
+app.config['SQLALCHEMY_READ_DATABASE_URI'] = database_url('DATABASE_READ_URL', None)
+app.config['READ_ROUTING'] = os.environ.get('READ_ROUTING', 'true').lower() in ('1', 'true', 'yes')
+# Optional per-branch databases for ticket, revenue and service-time data: explicit 'code=url' pairs,
+# and/or a template such as sqlite:///trimq_{branch}.db that gives every new branch its own file
+app.config['BRANCH_DATABASE_URLS'] = parse_branch_database_urls(os.environ.get('BRANCH_DATABASE_URLS', ''))
+app.config['BRANCH_DATABASE_URL_TEMPLATE'] = os.environ.get('BRANCH_DATABASE_URL_TEMPLATE')
+app.config['FANOUT_WORKERS'] = int(os.environ.get('FANOUT_WORKERS', 4))  # threads querying branch databases in parallel
+# Applied to every new SQLite connection. WAL lets the pollers read while a worker writes,
+# and busy_timeout makes a writer wait for the lock instead of failing with "database is locked".
+app.config['SQLITE_PRAGMAS'] = [
+    'journal_mode=WAL',
+    f"busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))}",
+    'synchronous=NORMAL',  # safe with WAL; a power cut can only lose the last transactions
+    f"mmap_size={int(os.environ.get('SQLITE_MMAP_MB', 256)) * 1024 * 1024}",
+    f"cache_size=-{int(os.environ.get('SQLITE_CACHE_MB', 64)) * 1024}",  # negative means KiB
+    'temp_store=MEMORY'
+]
 app.config['UPLOAD_FOLDER'] = 'static/uploads/customers'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
+app.config['SSE_HEARTBEAT_SECONDS'] = 15
+app.config['SSE_SYNC_SECONDS'] = 60  # refresh wait estimates on quiet branches
+app.config['SSE_REPLAY_BUFFER'] = 256
+# Completions can still land on a business day this long after it ends (slow commits, replica lag)
+app.config['REVENUE_DAY_CLOSE_GRACE_SECONDS'] = 900
+app.config['DURATION_EWMA_ALPHA'] = 0.2  # weight of the newest service time in the rolling average
+app.config['DURATION_MIN_SAMPLES'] = 5  # below this the catalog duration is used instead
+app.config['DURATION_MAX_MINUTES'] = 240  # longer services are treated as a forgotten "complete" tap
+app.config['DURATION_STATS_REFRESH_SECONDS'] = 300
+app.config['DISPATCH_MAX_WAIT_MINUTES'] = 45  # auto-dispatch seats anyone waiting longer than this first, whatever the policy
+app.config['SQL_INSTRUMENTATION'] = os.environ.get('SQL_INSTRUMENTATION', 'true').lower() in ('1', 'true', 'yes')
+# Server-Timing goes to signed-in staff only unless this is set (it reveals query counts to anyone)
+app.config['SERVER_TIMING_PUBLIC'] = os.environ.get('SERVER_TIMING_PUBLIC', 'false').lower() in ('1', 'true', 'yes')
+app.config['SQL_N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 10))  # same statement more often than this in one request
+app.config['DEBUG_REQUEST_BUFFER'] = 200  # recent requests kept for /debug/requests
+# Directory shared by gunicorn workers so /metrics adds up every worker; unset means this process only
+app.config['METRICS_MULTIPROC_DIR'] = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+app.config['METRICS_FLUSH_SECONDS'] = 5
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # scrapers send it as a Bearer token; unset: loopback only
+app.config['PHOTO_STAGING_FOLDER'] = os.path.join(app.instance_path, 'photo_staging')
+app.config['PHOTO_WORKERS'] = int(os.environ.get('PHOTO_WORKERS', 2))
+app.config['PHOTO_MAX_PENDING'] = int(os.environ.get('PHOTO_MAX_PENDING', 16))  # uploads wait for a slot beyond this
+app.config['PHOTO_WEBP'] = os.environ.get('PHOTO_WEBP', '').lower() in ('1', 'true', 'yes')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['PHOTO_STAGING_FOLDER'], exist_ok=True)
 
 # Email configuration (optional - can be configured later)
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() in ('1', 'true', 'yes')
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'TrimQ System <noreply@trimq.com>')
+# Mail is sent when credentials are set, or when MAIL_SERVER points somewhere explicit (e.g. a local SMTP stub)
+app.config['MAIL_ENABLED'] = bool(app.config['MAIL_USERNAME'] or os.environ.get('MAIL_SERVER'))
+app.config['MAIL_TIMEOUT'] = 10  # seconds per SMTP operation
+app.config['MAIL_BATCH_SIZE'] = 20
+app.config['MAIL_POLL_SECONDS'] = 5
+app.config['MAIL_IDLE_SECONDS'] = 60  # close the SMTP connection after this long without mail
+app.config['MAIL_MAX_ATTEMPTS'] = 6
+app.config['MAIL_RETRY_BASE_SECONDS'] = 30  # doubled after each failed attempt
+app.config['MAIL_BREAKER_FAILURES'] = 5  # consecutive connection failures before pausing
+app.config['MAIL_BREAKER_SECONDS'] = 300
+# Cross-worker cache invalidation: each process polls the cache_invalidation change log
+app.config['CACHE_BUS_ENABLED'] = os.environ.get('CACHE_BUS', 'true').lower() in ('1', 'true', 'yes')
+app.config['CACHE_BUS_POLL_MS'] = int(os.environ.get('CACHE_BUS_POLL_MS', 1000))
+app.config['CACHE_BUS_MAX_POLL_MS'] = int(os.environ.get('CACHE_BUS_MAX_POLL_MS', 5000))  # idle back-off ceiling
+app.config['CACHE_BUS_GRACE_SECONDS'] = 5  # re-read recent rows in case ids commit out of order (PostgreSQL)
+app.config['CACHE_BUS_RETENTION_SECONDS'] = 600
 
 # Initialize extensions
-db = SQLAlchemy(app)
+class RoutingSession(FlaskSession):
+    """Sends the SELECTs of @read_only views to the read engine; flushes and writes stay on the primary"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and getattr(clause, 'is_select', False)
+                and has_request_context() and g.get('read_only')):
+            return get_read_engine()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+@sa_event.listens_for(Engine, 'connect')
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in app.config['SQLITE_PRAGMAS']:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+_read_engine = None
+_read_engine_lock = threading.Lock()
+
+def get_read_engine():
+    """The engine for @read_only views, created on first use (the primary when routing is off or in-memory)"""
+    global _read_engine
+    with _read_engine_lock:
+        if _read_engine is None:
+            url = app.config['SQLALCHEMY_READ_DATABASE_URI'] or db.engine.url
+            if not app.config['READ_ROUTING'] or (db.engine.dialect.name == 'sqlite' and not db.engine.url.database):
+                _read_engine = db.engine
+            elif db.engine.dialect.name == 'postgresql':
+                _read_engine = create_engine(url, connect_args={'options': '-c default_transaction_read_only=on'},
+                                             **engine_options(str(url)))
+            else:
+                _read_engine = create_engine(url, **engine_options(str(url)))
+                # Same file, WAL mode: readers see every committed write and never block the writer
+                sa_event.listen(_read_engine, 'connect', _make_query_only)
+        return _read_engine
+
+def _make_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def read_only(view):
+    """Mark a view as read-only so its queries run on the read engine"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    return wrapped
+
+# Shard router: users, services, barbers, branches and customers stay in the central database.
+# A branch listed in BRANCH_DATABASE_URLS (or covered by the template) keeps its ticket
+# sequence, revenue rollup and service-time statistics in its own database, so completions
+# at one branch never wait on another branch's write lock. Franchise-wide reads go through
+# fan_out(), which queries every database in parallel and returns the parts to merge.
+_shard_engines = {}
+_shard_engines_lock = threading.Lock()
+_fanout_pool = None
+_fanout_pool_lock = threading.Lock()
+
+def shard_url(branch_code):
+    """Database URL of a branch's own database, or None when its data lives in the central one"""
+    url = app.config['BRANCH_DATABASE_URLS'].get(branch_code)
+    if url is None and app.config['BRANCH_DATABASE_URL_TEMPLATE']:
+        url = normalize_database_url(app.config['BRANCH_DATABASE_URL_TEMPLATE'].format(branch=branch_code))
+    if url is None:
+        return None
+    url = make_url(url)
+    # Relative SQLite paths live in the instance folder, like the central database
+    if url.drivername.startswith('sqlite') and url.database and url.database != ':memory:' \
+            and not os.path.isabs(url.database):
+        url = url.set(database=os.path.join(app.instance_path, url.database))
+    return url
+
+def shard_engine(branch_code):
+    """Engine of a branch's own database (created with its tables on first use), or None for the central one"""
+    url = shard_url(branch_code)
+    if url is None:
+        return None
+    key = url.render_as_string(hide_password=False)
+    with _shard_engines_lock:
+        engine = _shard_engines.get(key)
+        if engine is None:
+            engine = create_engine(url, **engine_options(key))
+            db.metadata.create_all(engine, tables=[model.__table__ for model in SHARDED_MODELS])
+            _shard_engines[key] = engine
+        return engine
+
+def shard_bind(branch_code):
+    """bind_arguments that send a statement on branch data to the branch's database"""
+    engine = shard_engine(branch_code)
+    return {'bind': engine} if engine is not None else {}
+
+def shard_groups(branch_codes):
+    """Group branch codes by database: [(engine, [branch codes])], engine None for the central one"""
+    groups = {}
+    for code in branch_codes:
+        engine = shard_engine(code)
+        groups.setdefault(id(engine), (engine, []))[1].append(code)
+    return list(groups.values())
+
+def _fanout_executor():
+    global _fanout_pool
+    with _fanout_pool_lock:
+        if _fanout_pool is None:
+            _fanout_pool = ThreadPoolExecutor(max_workers=app.config['FANOUT_WORKERS'], thread_name_prefix='fanout')
+        return _fanout_pool
+
+def fan_out(work, branch_codes):
+    """Run work(session, branch_codes) on every database holding the given branches and return the results.
+
+    Branch databases are queried on pool threads, each with its own session, while
+    the central database's part runs on the request session meanwhile. With a single
+    database work gets branch_codes=None, as no branch filter is needed.
+    """
+    groups = shard_groups(branch_codes)
+    
+    def run(engine, codes):
+        with OrmSession(bind=engine) as session:
+            return work(session, codes)
+    
+    if len(groups) == 1:
+        engine, _ = groups[0]
+        return [work(db.session, None) if engine is None else run(engine, None)]
+    futures = [_fanout_executor().submit(run, engine, codes) for engine, codes in groups if engine is not None]
+    results = [work(db.session, codes) for engine, codes in groups if engine is None]
+    return results + [future.result() for future in futures]
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -92,23 +336,10 @@ def init_database_with_error_handling():
     """Initialize database with proper error handling"""
     try:
         with app.app_context():
-            # Create all tables
-            db.create_all()
-            
-            # Run migrations
-            migrate_database()
-            migrate_customer_database()
-            
-            # Create sample data
-            create_sample_data()
-            
-            # Cleanup expired tokens
-            try:
-                expired_count = cleanup_expired_resets()
-                if expired_count > 0:
-                    print(f"Cleaned up {expired_count} expired password reset tokens")
-            except Exception as e:
-                print(f"Could not clean up expired tokens: {e}")
+            # Create tables and apply pending migrations
+            ensure_schema()
+            queue_store.rebuild_all()
+            email_sender.start()
             
             print("✅ TrimQ System Ready!")
             
@@ -142,8 +373,8 @@ def validate_form_data(form_data):
     else:
         try:
             service_id = int(service_id)
-            service = Service.query.filter_by(id=service_id, is_active=True).first()
-            if not service:
+            service = catalog.service(service_id)
+            if not service or not service['is_active']:
                 errors.append("Selected service is not available")
         except (ValueError, TypeError):
             errors.append("Invalid service selection")
@@ -183,22 +414,13 @@ def add_customer_with_better_handling(branch_code=None):
                     name=form.name.data.strip()
                 )
                 
-                # Add to queue
+                # Add to queue (also opens the visit record)
                 customer.add_to_queue(
                     service_id=int(form.service_id.data),
                     branch_code=branch_code,
                     notes=form.notes.data.strip() if form.notes.data else None
                 )
                 
-                # Create visit record
-                visit = CustomerVisit(
-                    customer_id=customer.id,
-                    service_id=customer.service_id,
-                    branch=branch_code,
-                    notes=customer.notes
-                )
-                db.session.add(visit)
-                
                 success_message = f'{customer.name} added to queue!'
                 if is_new:
                     success_message += ' (New customer created)'
@@ -261,6 +483,8 @@ class Branch(db.Model):
     address = db.Column(db.Text)
     phone = db.Column(db.String(20))
     is_active = db.Column(db.Boolean, default=True)
+    auto_dispatch = db.Column(db.Boolean, default=False)  # seat the next customer as soon as a barber is free
+    dispatch_policy = db.Column(db.String(30), default='fifo')  # a key of DISPATCH_POLICIES
 
 class Service(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -282,6 +506,7 @@ class Customer(db.Model):
     email = db.Column(db.String(120), nullable=True)
     address = db.Column(db.Text, nullable=True)
     photo_filename = db.Column(db.String(255), nullable=True)
+    photo_status = db.Column(db.String(20), nullable=True)  # pending, ready, failed; NULL for legacy photos
     notes = db.Column(db.Text)
     
     # Queue-specific fields (for current visit)
@@ -289,6 +514,7 @@ class Customer(db.Model):
     status = db.Column(db.String(20), default='registered')  # registered, waiting, assigned, completed
     barber_id = db.Column(db.Integer, db.ForeignKey('barber.id'), nullable=True)
     branch = db.Column(db.String(100), nullable=True)
+    ticket_number = db.Column(db.String(30), nullable=True)  # e.g. MAIN-007, issued when joining the queue
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # First registration
@@ -306,10 +532,16 @@ class Customer(db.Model):
     def __repr__(self):
         return f'<Customer {self.name}>'
     
-    def get_photo_url(self):
-        """Get the URL for customer photo"""
+    def get_photo_url(self, size=None):
+        """Get the URL for customer photo, optionally a smaller 'md' or 'sm' rendition"""
         if self.photo_filename:
-            return f'/static/uploads/customers/{self.photo_filename}'
+            filename = self.photo_filename
+            # Only processed photos have renditions
+            if size and self.photo_status == 'ready':
+                filename = photo_rendition_name(filename, size)
+            return f'/static/uploads/customers/{filename}'
+        if self.photo_status == 'pending':
+            return PHOTO_PENDING_URL
         return None
     
     def add_to_queue(self, service_id, branch_code, notes=None):
@@ -323,25 +555,28 @@ class Customer(db.Model):
             raise ValueError("Branch code is required")
         
         # Verify the service exists and is active
-        service = Service.query.filter_by(id=service_id, is_active=True).first()
-        if not service:
+        service = catalog.service(service_id)
+        if not service or not service['is_active']:
             raise ValueError("Invalid service selected or service is not available")
         
         # Verify the branch exists
-        branch = Branch.query.filter_by(code=branch_code, is_active=True).first()
-        if not branch:
+        branches = catalog.branches()
+        branch = branches.get(branch_code)
+        if not branch or not branch['is_active']:
             raise ValueError("Invalid branch selected")
         
         # Check if customer is already in an active queue
         if self.status in ['waiting', 'assigned']:
             if self.branch == branch_code:
-                raise ValueError(f"Customer is already in the queue for {branch.name}")
+                raise ValueError(f"Customer is already in the queue for {branch['name']}")
             else:
                 # Customer is in queue for different branch
-                existing_branch = Branch.query.filter_by(code=self.branch).first()
-                existing_branch_name = existing_branch.name if existing_branch else self.branch
+                existing_branch = branches.get(self.branch)
+                existing_branch_name = existing_branch['name'] if existing_branch else self.branch
                 raise ValueError(f"Customer is currently in queue for {existing_branch_name}. Please complete or cancel that service first.")
         
+        previous_branch = self.branch
+        
         # Set queue information
         self.service_id = service_id
         self.branch = branch_code
@@ -354,6 +589,20 @@ class Customer(db.Model):
         self.barber_id = None
         self.assigned_at = None
         self.completed_at = None
+        self.ticket_number = format_ticket_number(branch_code, next_ticket_sequence(branch_code, business_today()))
+        
+        # Open the visit record for this queue entry
+        visit = CustomerVisit(
+            customer=self,
+            service_id=service_id,
+            branch=branch_code,
+            visit_date=self.last_visit,
+            notes=notes
+        )
+        db.session.add(visit)
+        
+        stage_queue_event(self, 'added', previous_branch)
+        return visit
 
 # Added a new model for customer visit history
 class CustomerVisit(db.Model):
@@ -364,14 +613,105 @@ class CustomerVisit(db.Model):
     branch = db.Column(db.String(100), nullable=False)
     
     visit_date = db.Column(db.DateTime, default=datetime.utcnow)
+    assigned_at = db.Column(db.DateTime, nullable=True)
     completed_at = db.Column(db.DateTime, nullable=True)
-    price_paid = db.Column(db.Float, nullable=True)
+    price_paid = db.Column(db.Float, nullable=True)  # Price charged at completion, not the current service price
+    duration_minutes = db.Column(db.Float, nullable=True)
     notes = db.Column(db.Text)
     
     # Relationships
     customer = db.relationship('Customer', backref='visit_history')
     service = db.relationship('Service')
     barber = db.relationship('Barber')
+    
+    __table_args__ = (
+        db.Index('ix_customer_visit_branch_completed', 'branch', 'completed_at'),
+        db.Index('ix_customer_visit_customer_date', 'customer_id', 'visit_date'),
+    )
+    
+    @staticmethod
+    def open_for(customer):
+        """Get the customer's current (not yet completed) visit"""
+        return CustomerVisit.query.filter_by(
+            customer_id=customer.id,
+            completed_at=None
+        ).order_by(CustomerVisit.visit_date.desc()).first()
+
+class RevenueRollup(db.Model):
+    """Completed-service revenue per day, branch, service and hour, kept up to date on completion"""
+    __tablename__ = 'revenue_rollup'
+    
+    business_date = db.Column(db.Date, primary_key=True)
+    branch = db.Column(db.String(100), primary_key=True)
+    service_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    customers = db.Column(db.Integer, nullable=False, default=0)
+
+class DurationStat(db.Model):
+    """Rolling service time per branch, barber, service and hour band, updated on every completion"""
+    __tablename__ = 'duration_stats'
+    
+    branch = db.Column(db.String(100), primary_key=True)
+    barber_id = db.Column(db.Integer, primary_key=True)
+    service_id = db.Column(db.Integer, primary_key=True)
+    hour_band = db.Column(db.Integer, primary_key=True)  # see hour_band()
+    
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    mean_minutes = db.Column(db.Float, nullable=False, default=0)
+    m2 = db.Column(db.Float, nullable=False, default=0)  # sum of squared deviations from the mean (Welford)
+    ewma_minutes = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def stddev_minutes(self):
+        return (self.m2 / (self.samples - 1)) ** 0.5 if self.samples > 1 else 0.0
+
+class TicketSequence(db.Model):
+    """Last ticket number issued per branch and business day"""
+    __tablename__ = 'ticket_sequence'
+    
+    branch = db.Column(db.String(100), primary_key=True)
+    business_date = db.Column(db.Date, primary_key=True)
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+
+# Branch-keyed tables that live in a branch's own database when it has one (see shard_engine)
+SHARDED_MODELS = (TicketSequence, RevenueRollup, DurationStat)
+
+class SchemaVersion(db.Model):
+    """One row per applied schema migration"""
+    __tablename__ = 'schema_version'
+    
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CatalogVersion(db.Model):
+    """Single-row counter bumped whenever branches, services or barbers change"""
+    __tablename__ = 'catalog_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BranchStateVersion(db.Model):
+    """Per-branch counter bumped in every transaction that changes the branch's queue or revenue"""
+    __tablename__ = 'branch_state_version'
+    
+    branch = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class CacheInvalidation(db.Model):
+    """Change log of cache-affecting commits, polled by every process to evict its in-memory copies"""
+    __tablename__ = 'cache_invalidation'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(20), nullable=False)  # queue, catalog, revenue
+    branch = db.Column(db.String(100))  # None means every branch
+    version = db.Column(db.Integer)
+    origin = db.Column(db.String(120), nullable=False)  # host:pid of the writer
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
 class PasswordReset(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -389,6 +729,27 @@ class PasswordReset(db.Model):
     def is_valid(self):
         return not self.used and not self.is_expired()
 
+class EmailOutbox(db.Model):
+    """Outgoing email, written in the request's transaction and delivered by the background sender"""
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    text_body = db.Column(db.Text, nullable=False)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Due time; a sender claims a message by pushing this forward by a lease
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_due', 'status', 'next_attempt_at'),
+    )
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -412,9 +773,9 @@ class CustomerForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super(CustomerForm, self).__init__(*args, **kwargs)
         try:
-            services = Service.query.filter_by(is_active=True).order_by('name').all()
+            services = catalog.active_services()
             # Add a default empty option that will force validation
-            self.service_id.choices = [(0, "Choose a service...")] + [(s.id, f"{s.name} ({s.duration} min • GH₵{s.price:.0f})") for s in services]
+            self.service_id.choices = [(0, "Choose a service...")] + [(s['id'], f"{s['name']} ({s['duration']} min • GH₵{s['price']:.0f})") for s in services]
         except Exception as e:
             print(f"Error loading services: {e}")
             self.service_id.choices = [(0, "Error loading services")]
@@ -443,21 +804,12 @@ class ResetPasswordForm(FlaskForm):
 # ============================================================================
 
 def send_password_reset_email(user, token):
-    """Send password reset email to user"""
-    if not app.config['MAIL_USERNAME']:
+    """Queue a password reset email for the user; delivered after the session commits"""
+    if not app.config['MAIL_ENABLED']:
         print("Email not configured. Password reset email would be sent to:", user.email)
         return False
     
     try:
-        import smtplib
-        from email.mime.text import MIMEText
-        from email.mime.multipart import MIMEMultipart
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = 'TrimQ - Password Reset Request'
-        msg['From'] = app.config['MAIL_DEFAULT_SENDER']
-        msg['To'] = user.email
-        
         reset_url = url_for('reset_password', token=token, _external=True)
         
         html_body = f"""
@@ -531,187 +883,902 @@ def send_password_reset_email(user, token):
         TrimQ Franchise Management System
         """
         
-        msg.attach(MIMEText(text_body, 'plain'))
-        msg.attach(MIMEText(html_body, 'html'))
-        
-        with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT']) as server:
-            server.starttls()
-            server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-            server.send_message(msg)
-            
+        enqueue_email(user.email, 'TrimQ - Password Reset Request', text_body, html_body)
         return True
     except Exception as e:
-        print(f"Email sending failed: {e}")
+        print(f"Email queueing failed: {e}")
         return False
 
+def enqueue_email(recipient, subject, text_body, html_body=None):
+    """Add an email to the outbox in the current transaction"""
+    message = EmailOutbox(
+        recipient=recipient,
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.session.add(message)
+    db.session.info['email_queued'] = True
+    return message
+
+def build_email_message(message):
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = message.subject
+    msg['From'] = app.config['MAIL_DEFAULT_SENDER']
+    msg['To'] = message.recipient
+    msg.attach(MIMEText(message.text_body, 'plain'))
+    if message.html_body:
+        msg.attach(MIMEText(message.html_body, 'html'))
+    return msg
+
+class EmailOutboxSender:
+    """Delivers outbox messages from one background thread over a reused SMTP connection.
+
+    Messages are claimed by moving next_attempt_at forward by a lease, so several
+    worker processes can run a sender against the same outbox and a crashed
+    sender's claims simply expire. Failed messages are retried with exponential
+    backoff; repeated connection failures open a circuit breaker that pauses
+    delivery for MAIL_BREAKER_SECONDS.
+    """
+    
+    LEASE_SECONDS = 120
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._last_used = 0
+        self._consecutive_failures = 0
+        self._paused_until = 0
+    
+    def start(self):
+        """Start the sender thread if mail is enabled and it isn't running yet"""
+        if not app.config['MAIL_ENABLED']:
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+            self._thread.start()
+    
+    def wake(self):
+        self._wake.set()
+    
+    def _run(self):
+        while True:
+            self._wake.wait(app.config['MAIL_POLL_SECONDS'])
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    while self.send_batch() == app.config['MAIL_BATCH_SIZE']:
+                        pass
+            except Exception as e:
+                print(f"Email sender error: {e}")
+            if self._smtp and time.monotonic() - self._last_used > app.config['MAIL_IDLE_SECONDS']:
+                self._disconnect()
+    
+    def _connect(self):
+        if self._smtp is not None:
+            return self._smtp
+        smtp = smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=app.config['MAIL_TIMEOUT'])
+        try:
+            if app.config['MAIL_USE_TLS']:
+                smtp.starttls()
+            if app.config['MAIL_USERNAME']:
+                smtp.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        return smtp
+    
+    def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+    
+    def _claim_batch(self, now):
+        """Claim up to a batch of due messages for this sender"""
+        due_ids = [row[0] for row in db.session.query(EmailOutbox.id).filter(
+            EmailOutbox.status == 'pending',
+            EmailOutbox.next_attempt_at <= now
+        ).order_by(EmailOutbox.next_attempt_at).limit(app.config['MAIL_BATCH_SIZE'])]
+        
+        lease_until = now + timedelta(seconds=self.LEASE_SECONDS)
+        claimed = []
+        for message_id in due_ids:
+            result = db.session.execute(
+                db.update(EmailOutbox).where(
+                    EmailOutbox.id == message_id,
+                    EmailOutbox.status == 'pending',
+                    EmailOutbox.next_attempt_at <= now
+                ).values(next_attempt_at=lease_until)
+            )
+            if result.rowcount:
+                claimed.append(message_id)
+        db.session.commit()
+        if not claimed:
+            return []
+        return EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id).all()
+    
+    def _record_failure(self, message, error):
+        message.attempts += 1
+        message.last_error = str(error)[:1000]
+        if message.attempts >= app.config['MAIL_MAX_ATTEMPTS']:
+            message.status = 'failed'
+        else:
+            delay = app.config['MAIL_RETRY_BASE_SECONDS'] * 2 ** (message.attempts - 1)
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    
+    def send_batch(self):
+        """Send one batch of due messages; returns how many were claimed"""
+        if time.monotonic() < self._paused_until:
+            return 0
+        
+        batch = self._claim_batch(datetime.utcnow())
+        for index, message in enumerate(batch):
+            try:
+                self._connect().send_message(build_email_message(message))
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                # The server answered; this message is the problem, not the connection
+                self._record_failure(message, e)
+                self._last_used = time.monotonic()
+                continue
+            except (smtplib.SMTPException, OSError) as e:
+                self._disconnect()
+                self._consecutive_failures += 1
+                self._record_failure(message, e)
+                if self._consecutive_failures >= app.config['MAIL_BREAKER_FAILURES']:
+                    self._paused_until = time.monotonic() + app.config['MAIL_BREAKER_SECONDS']
+                    print(f"Email sending paused for {app.config['MAIL_BREAKER_SECONDS']}s after "
+                          f"{self._consecutive_failures} consecutive failures: {e}")
+                    self._consecutive_failures = 0
+                # Release the rest of the batch for the next attempt
+                for pending in batch[index + 1:]:
+                    pending.next_attempt_at = datetime.utcnow()
+                break
+            
+            message.status = 'sent'
+            message.sent_at = datetime.utcnow()
+            message.attempts += 1
+            self._consecutive_failures = 0
+            self._last_used = time.monotonic()
+        db.session.commit()
+        return len(batch)
+    
+    def drain(self):
+        """Send everything currently due from the calling thread; returns the number attempted"""
+        attempted = 0
+        while True:
+            count = self.send_batch()
+            attempted += count
+            if count < app.config['MAIL_BATCH_SIZE']:
+                break
+        self._disconnect()
+        return attempted
+
+email_sender = EmailOutboxSender()
+
+@sa_event.listens_for(OrmSession, 'after_commit')
+def _wake_email_sender(session):
+    if session.info.pop('email_queued', False):
+        email_sender.start()
+        email_sender.wake()
+
+@sa_event.listens_for(OrmSession, 'after_rollback')
+def _discard_email_wakeup(session):
+    session.info.pop('email_queued', None)
+
 # ============================================================================
 # UTILITY FUNCTIONS
 # ============================================================================
 
 def get_branches_dict():
     """Get branches as a dictionary"""
-    branches = Branch.query.all()
-    return {
-        branch.code: {
-            'name': branch.name,
-            'address': branch.address,
-            'phone': branch.phone
-        }
-        for branch in branches
-    }
+    return dict(catalog.branches())
+
+def business_today():
+    """Today's business date; visits, the revenue rollup and ticket numbers are dated in UTC"""
+    return datetime.utcnow().date()
+
+def business_day_closed(day):
+    """True once no more completions can be recorded for a business date"""
+    closes_at = datetime.combine(day + timedelta(days=1), datetime.min.time())
+    return datetime.utcnow() >= closes_at + timedelta(seconds=app.config['REVENUE_DAY_CLOSE_GRACE_SECONDS'])
+
+def format_wait_time(wait_minutes):
+    """Format an estimated wait in minutes for display"""
+    if wait_minutes is None:
+        return None
+    if wait_minutes <= 0:
+        return "Up Next!"
+    return f"~{wait_minutes} min"
 
 def get_wait_time(customer):
     """Calculate estimated wait time"""
     if customer.status != 'waiting':
         return None
     
-    earlier_customers = Customer.query.filter(
-        Customer.branch == customer.branch,
-        Customer.status == 'waiting',
-        Customer.created_at < customer.created_at
-    ).order_by(Customer.created_at).all()
-    
-    total_wait = sum(Service.query.get(c.service_id).duration or 0 for c in earlier_customers)
-    
-    if total_wait == 0:
-        return "Up Next!"
-    elif total_wait <= 15:
-        return f"~{total_wait} min"
-    else:
-        return f"~{total_wait} min"
+    return estimate_queue(customer.branch)['wait_times'].get(customer.id)
 
 def get_branch_stats(branch_code):
     """Get statistics for a branch"""
-    waiting = Customer.query.filter_by(branch=branch_code, status='waiting').count()
-    in_progress = Customer.query.filter_by(branch=branch_code, status='assigned').count()
-    completed_today = Customer.query.filter(
-        Customer.branch == branch_code,
-        Customer.status == 'completed',
-        Customer.completed_at >= datetime.now().replace(hour=0, minute=0, second=0)
-    ).count()
-    active_barbers = Barber.query.filter_by(branch=branch_code).count()
+    state = queue_store.snapshot(branch_code)
     
     return {
-        'waiting': waiting,
-        'in_progress': in_progress,
-        'completed_today': completed_today,
-        'active_barbers': active_barbers
+        'waiting': len(state['waiting']),
+        'in_progress': len(state['in_progress']),
+        'completed_today': state['completed_today'],
+        'active_barbers': len(state['barbers'])
     }
 
-def get_real_time_revenue_data(target_date=None, branch_code=None):
-    """Get real-time revenue data calculated from completed customers"""
+class RevenueDayCache:
+    """Per-day revenue by branch and service, kept forever once the day has closed.
+
+    Completed revenue for a past business day only changes when the rollup is
+    rebuilt (which clears the affected days), so closed days are read from the
+    rollup once per process. Today, and yesterday until its grace window has
+    passed, are always recomputed.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._days = {}  # business_date -> [(branch, service_id, revenue, customers)]
+    
+    def get(self, start_date, end_date):
+        """Get {business_date: rows} for every day in the range, in one grouped query for uncached days"""
+        days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+        with self._lock:
+            result = {day: self._days[day] for day in days if day in self._days}
+        missing = [day for day in days if day not in result]
+        if not missing:
+            return result
+        
+        fetched = {day: [] for day in missing}
+        
+        def query_shard(session, branch_codes):
+            query = session.query(
+                RevenueRollup.business_date,
+                RevenueRollup.branch,
+                RevenueRollup.service_id,
+                func.sum(RevenueRollup.revenue),
+                func.sum(RevenueRollup.customers)
+            ).filter(
+                RevenueRollup.business_date >= missing[0],
+                RevenueRollup.business_date <= missing[-1]
+            )
+            if branch_codes is not None:
+                query = query.filter(RevenueRollup.branch.in_(branch_codes))
+            return query.group_by(
+                RevenueRollup.business_date, RevenueRollup.branch, RevenueRollup.service_id
+            ).all()
+        
+        for rows in fan_out(query_shard, list(get_branches_dict())):
+            for business_date, branch, service_id, revenue, customers in rows:
+                if business_date in fetched:
+                    fetched[business_date].append((branch, service_id, float(revenue or 0), int(customers or 0)))
+        
+        with self._lock:
+            for day, day_rows in fetched.items():
+                if business_day_closed(day):
+                    self._days[day] = day_rows
+        result.update(fetched)
+        return result
+    
+    def clear(self, start_date=None, end_date=None):
+        """Forget cached days (all of them, or a date range)"""
+        with self._lock:
+            if start_date is None:
+                self._days = {}
+            else:
+                for day in [d for d in self._days if start_date <= d <= (end_date or start_date)]:
+                    del self._days[day]
+
+revenue_days = RevenueDayCache()
+
+ServiceRevenue = namedtuple('ServiceRevenue', ['service_id', 'name', 'price', 'service_count', 'service_revenue'])
+
+def _revenue_rows(start_date, end_date, branch_code=None):
+    """Yield (business_date, branch, service_id, revenue, customers) for a date range"""
+    for business_date, day_rows in sorted(revenue_days.get(start_date, end_date).items()):
+        for branch, service_id, revenue, customers in day_rows:
+            if branch_code is None or branch == branch_code:
+                yield business_date, branch, service_id, revenue, customers
+
+def get_real_time_revenue_data(target_date=None, branch_code=None, end_date=None):
+    """Get revenue per branch for a day, or for the range target_date..end_date"""
     if not target_date:
-        target_date = date.today()
-    
-    start_datetime = datetime.combine(target_date, datetime.min.time())
-    end_datetime = datetime.combine(target_date, datetime.max.time())
-    
-    query = db.session.query(
-        Customer.branch,
-        func.sum(Service.price).label('total_revenue'),
-        func.count(Customer.id).label('total_customers')
-    ).join(Service, Customer.service_id == Service.id).filter(
-        Customer.status == 'completed',
-        Customer.completed_at >= start_datetime,
-        Customer.completed_at <= end_datetime
-    )
-    
-    if branch_code:
-        query = query.filter(Customer.branch == branch_code)
+        target_date = business_today()
+    end_date = end_date or target_date
     
-    revenue_data = query.group_by(Customer.branch).order_by(
-        func.sum(Service.price).desc()
-    ).all()
+    totals = {}
+    for _, branch, _, revenue, customers in _revenue_rows(target_date, end_date, branch_code):
+        branch_revenue, branch_customers = totals.get(branch, (0.0, 0))
+        totals[branch] = (branch_revenue + revenue, branch_customers + customers)
     
     result = []
-    for record in revenue_data:
+    for branch, (revenue, customers) in sorted(totals.items(), key=lambda item: -item[1][0]):
         result.append({
-            'branch': record.branch,
-            'total_revenue': float(record.total_revenue or 0),
-            'total_customers': int(record.total_customers or 0),
+            'branch': branch,
+            'total_revenue': revenue,
+            'total_customers': customers,
             'date': target_date,
             'updated_at': datetime.utcnow()
         })
     
     return result
 
-def get_branch_revenue_summary(branch_code, target_date=None):
+def get_branch_revenue_summary(branch_code, target_date=None, end_date=None):
     """Get revenue summary for a specific branch"""
     if not target_date:
-        target_date = date.today()
-    
-    start_datetime = datetime.combine(target_date, datetime.min.time())
-    end_datetime = datetime.combine(target_date, datetime.max.time())
+        target_date = business_today()
     
-    result = db.session.query(
-        func.sum(Service.price).label('total_revenue'),
-        func.count(Customer.id).label('total_customers')
-    ).join(Service, Customer.service_id == Service.id).filter(
-        Customer.branch == branch_code,
-        Customer.status == 'completed',
-        Customer.completed_at >= start_datetime,
-        Customer.completed_at <= end_datetime
-    ).first()
+    total_revenue = 0.0
+    total_customers = 0
+    for _, _, _, revenue, customers in _revenue_rows(target_date, end_date or target_date, branch_code):
+        total_revenue += revenue
+        total_customers += customers
     
     return {
         'branch': branch_code,
-        'total_revenue': float(result.total_revenue or 0),
-        'total_customers': int(result.total_customers or 0),
+        'total_revenue': total_revenue,
+        'total_customers': total_customers,
         'date': target_date,
         'updated_at': datetime.utcnow()
     }
 
-def get_service_breakdown(branch_code=None, target_date=None):
+def get_service_breakdown(branch_code=None, target_date=None, end_date=None):
     """Get service-wise revenue breakdown"""
     if not target_date:
-        target_date = date.today()
-    
-    start_datetime = datetime.combine(target_date, datetime.min.time())
-    end_datetime = datetime.combine(target_date, datetime.max.time())
-    
-    query = db.session.query(
-        Service.name,
-        Service.price,
-        func.count(Customer.id).label('service_count'),
-        func.sum(Service.price).label('service_revenue')
-    ).join(Customer, Customer.service_id == Service.id).filter(
-        Customer.status == 'completed',
-        Customer.completed_at >= start_datetime,
-        Customer.completed_at <= end_datetime
-    )
-    
-    if branch_code:
-        query = query.filter(Customer.branch == branch_code)
+        target_date = business_today()
+    
+    totals = {}
+    for _, _, service_id, revenue, customers in _revenue_rows(target_date, end_date or target_date, branch_code):
+        service_revenue, service_count = totals.get(service_id, (0.0, 0))
+        totals[service_id] = (service_revenue + revenue, service_count + customers)
+    
+    breakdown = []
+    for service_id, (revenue, count) in totals.items():
+        service = catalog.service(service_id)
+        if service:
+            breakdown.append(ServiceRevenue(service_id, service['name'], service['price'], count, revenue))
+    return sorted(breakdown, key=lambda row: -row.service_revenue)
+
+def get_revenue_series(start_date, end_date, branch_code=None):
+    """Get per-day, per-branch and per-service revenue for a date range"""
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    day_index = {day: index for index, day in enumerate(days)}
+    daily = [{'date': day, 'revenue': 0.0, 'customers': 0} for day in days]
+    branches = {}
+    services = {}
+    
+    for business_date, branch, service_id, revenue, customers in _revenue_rows(start_date, end_date, branch_code):
+        day = daily[day_index[business_date]]
+        day['revenue'] += revenue
+        day['customers'] += customers
+        
+        branch_series = branches.setdefault(branch, {
+            'branch': branch, 'revenue': 0.0, 'customers': 0, 'daily_revenue': [0.0] * len(days)
+        })
+        branch_series['revenue'] += revenue
+        branch_series['customers'] += customers
+        branch_series['daily_revenue'][day_index[business_date]] += revenue
+        
+        service_total = services.setdefault(service_id, {'revenue': 0.0, 'customers': 0})
+        service_total['revenue'] += revenue
+        service_total['customers'] += customers
+    
+    service_series = []
+    for service_id, totals in services.items():
+        service = catalog.service(service_id)
+        service_series.append({
+            'service_id': service_id,
+            'service_name': service['name'] if service else f'Service #{service_id}',
+            'revenue': totals['revenue'],
+            'customers': totals['customers']
+        })
     
-    return query.group_by(Service.id).order_by(
-        func.sum(Service.price).desc()
-    ).all()
+    return {
+        'start': start_date,
+        'end': end_date,
+        'daily': daily,
+        'branches': sorted(branches.values(), key=lambda b: -b['revenue']),
+        'services': sorted(service_series, key=lambda s: -s['revenue']),
+        'totals': {
+            'revenue': sum(day['revenue'] for day in daily),
+            'customers': sum(day['customers'] for day in daily)
+        }
+    }
 
-def get_hourly_revenue_trend(branch_code=None, target_date=None):
-    """Get hourly revenue trend for the day"""
+HourlyRevenue = namedtuple('HourlyRevenue', ['hour', 'hour_revenue', 'hour_customers'])
+
+def get_hourly_revenue_trend(branch_code=None, target_date=None, end_date=None):
+    """Get hourly revenue trend for the day (or summed over a date range)"""
     if not target_date:
-        target_date = date.today()
-    
-    start_datetime = datetime.combine(target_date, datetime.min.time())
-    end_datetime = datetime.combine(target_date, datetime.max.time())
-    
-    query = db.session.query(
-        func.extract('hour', Customer.completed_at).label('hour'),
-        func.sum(Service.price).label('hour_revenue'),
-        func.count(Customer.id).label('hour_customers')
-    ).join(Service, Customer.service_id == Service.id).filter(
-        Customer.status == 'completed',
-        Customer.completed_at >= start_datetime,
-        Customer.completed_at <= end_datetime
+        target_date = business_today()
+    
+    def query_shard(session, branch_codes):
+        query = session.query(
+            RevenueRollup.hour,
+            func.sum(RevenueRollup.revenue),
+            func.sum(RevenueRollup.customers)
+        ).filter(
+            RevenueRollup.business_date >= target_date,
+            RevenueRollup.business_date <= (end_date or target_date)
+        )
+        if branch_code:
+            query = query.filter(RevenueRollup.branch == branch_code)
+        elif branch_codes is not None:
+            query = query.filter(RevenueRollup.branch.in_(branch_codes))
+        return query.group_by(RevenueRollup.hour).all()
+    
+    hours = {}
+    for rows in fan_out(query_shard, [branch_code] if branch_code else list(get_branches_dict())):
+        for hour, revenue, customers in rows:
+            hour_revenue, hour_customers = hours.get(hour, (0.0, 0))
+            hours[hour] = (hour_revenue + float(revenue or 0), hour_customers + int(customers or 0))
+    return [HourlyRevenue(hour, revenue, customers) for hour, (revenue, customers) in sorted(hours.items())]
+
+def conditional_response(etag_parts, build):
+    """Answer 304 when the client's If-None-Match matches an ETag derived from etag_parts; otherwise build()"""
+    etag = hashlib.sha1('|'.join(str(part) for part in etag_parts).encode()).hexdigest()[:24]
+    # Pending flash messages belong in a fresh render, never a cached page
+    if '_flashes' not in flask_session and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def branch_etag_parts(branch_code):
+    """State that a branch's queue pages depend on: its version, the catalog and the minute (wait estimates)"""
+    version = get_branch_versions([branch_code]).get(branch_code, 0)
+    # The body must be built from at least this version, or a stale page would get the new ETag
+    queue_store.sync_version(branch_code, version)
+    return [branch_code, version, catalog.version(), datetime.now().strftime('%Y-%m-%dT%H:%M')]
+
+def revenue_etag_parts(branch_code, start_date, end_date):
+    """State revenue responses depend on; branch_code None means every branch"""
+    versions = get_branch_versions(None if branch_code is None else [branch_code])
+    return ['revenue', branch_code or 'all', start_date, end_date, business_today(),
+            sorted(versions.items()), catalog.version()]
+
+# Longest range the reports accept, to keep one request from reading years of rollup
+MAX_REPORT_DAYS = 366
+
+def parse_report_range(args):
+    """Read start/end (or a single date) from request args; raises ValueError on bad input"""
+    today = business_today()
+    start_str = args.get('start') or args.get('date')
+    end_str = args.get('end')
+    start_date = datetime.strptime(start_str, '%Y-%m-%d').date() if start_str else today
+    end_date = datetime.strptime(end_str, '%Y-%m-%d').date() if end_str else start_date
+    if end_date < start_date:
+        raise ValueError('end must not be before start')
+    if (end_date - start_date).days >= MAX_REPORT_DAYS:
+        raise ValueError(f'date range is limited to {MAX_REPORT_DAYS} days')
+    return start_date, end_date
+
+def dialect_insert(table, engine=None):
+    """Get an INSERT construct that supports ON CONFLICT for the given (default: central) database"""
+    if (engine or db.engine).dialect.name == 'postgresql':
+        return postgresql_dialect.insert(table)
+    return sqlite_dialect.insert(table)
+
+def record_completed_revenue(branch_code, service_id, completed_at, price):
+    """Add one completed service to the revenue rollup in the current transaction"""
+    table = RevenueRollup.__table__
+    bind = shard_bind(branch_code)
+    stmt = dialect_insert(table, bind.get('bind')).values(
+        business_date=completed_at.date(),
+        branch=branch_code,
+        service_id=service_id,
+        hour=completed_at.hour,
+        revenue=price or 0,
+        customers=1
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.business_date, table.c.branch, table.c.service_id, table.c.hour],
+        set_={
+            'revenue': table.c.revenue + stmt.excluded.revenue,
+            'customers': table.c.customers + stmt.excluded.customers
+        }
+    )
+    db.session.execute(stmt, bind_arguments=bind)
+    if business_day_closed(completed_at.date()):
+        # Backdated completion: workers may have this day cached
+        publish_invalidation(db.session, 'revenue', branch_code)
+
+def hour_band(moment):
+    """Bucket a time of day for service-time statistics: 0 morning, 1 afternoon, 2 evening"""
+    if moment.hour < 12:
+        return 0
+    return 1 if moment.hour < 16 else 2
+
+def valid_service_minutes(minutes):
+    return minutes is not None and 0 < minutes <= app.config['DURATION_MAX_MINUTES']
+
+def record_service_duration(branch_code, barber_id, service_id, assigned_at, minutes):
+    """Fold one completed service into duration_stats in the current transaction"""
+    if not (barber_id and service_id and assigned_at) or not valid_service_minutes(minutes):
+        return
+    table = DurationStat.__table__
+    alpha = app.config['DURATION_EWMA_ALPHA']
+    bind = shard_bind(branch_code)
+    stmt = dialect_insert(table, bind.get('bind')).values(
+        branch=branch_code,
+        barber_id=barber_id,
+        service_id=service_id,
+        hour_band=hour_band(assigned_at),
+        samples=1,
+        mean_minutes=minutes,
+        m2=0.0,
+        ewma_minutes=minutes,
+        updated_at=datetime.utcnow()
     )
+    # Column references on the right-hand side read the row as it was before this update
+    new_mean = table.c.mean_minutes + (minutes - table.c.mean_minutes) / (table.c.samples + 1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.branch, table.c.barber_id, table.c.service_id, table.c.hour_band],
+        set_={
+            'samples': table.c.samples + 1,
+            'mean_minutes': new_mean,
+            'm2': table.c.m2 + (minutes - table.c.mean_minutes) * (minutes - new_mean),
+            'ewma_minutes': table.c.ewma_minutes + alpha * (minutes - table.c.ewma_minutes),
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+    db.session.execute(stmt, bind_arguments=bind)
+
+def replace_branch_rows(session, table, criteria, rows):
+    """Replace a branch-keyed table's rows matching criteria with rows, each in its branch's database.
+
+    The delete runs on every database holding branch data and the session commits them together.
+    """
+    codes = {code for code, in session.query(Branch.code)} | set(app.config['BRANCH_DATABASE_URLS'])
+    groups = shard_groups(sorted(codes | {row['branch'] for row in rows}))
+    if all(engine is not None for engine, _ in groups):
+        groups.append((None, []))  # rows written before the branches got their own databases
+    for engine, branch_codes in groups:
+        bind = {'bind': engine} if engine is not None else {}
+        session.execute(delete(table).where(*criteria), bind_arguments=bind)
+        branch_rows = [row for row in rows if row['branch'] in branch_codes]
+        if branch_rows:
+            session.execute(table.insert(), branch_rows, bind_arguments=bind)
+
+def rebuild_duration_stats(session=None):
+    """Recompute duration_stats from every timed completed visit in one pass"""
+    session = session or db.session
+    alpha = app.config['DURATION_EWMA_ALPHA']
+    
+    timed = session.query(
+        CustomerVisit.branch,
+        CustomerVisit.barber_id,
+        CustomerVisit.service_id,
+        CustomerVisit.assigned_at,
+        CustomerVisit.duration_minutes
+    ).filter(
+        CustomerVisit.barber_id.isnot(None),
+        CustomerVisit.assigned_at.isnot(None),
+        CustomerVisit.duration_minutes.isnot(None)
+    ).order_by(CustomerVisit.completed_at).yield_per(1000)
+    
+    stats = {}
+    for record in timed:
+        minutes = record.duration_minutes
+        if not valid_service_minutes(minutes):
+            continue
+        key = (record.branch, record.barber_id, record.service_id, hour_band(record.assigned_at))
+        entry = stats.get(key)
+        if entry is None:
+            stats[key] = [1, minutes, 0.0, minutes]
+            continue
+        samples, mean, m2, ewma = entry
+        samples += 1
+        new_mean = mean + (minutes - mean) / samples
+        stats[key] = [samples, new_mean, m2 + (minutes - mean) * (minutes - new_mean), ewma + alpha * (minutes - ewma)]
+    
+    now = datetime.utcnow()
+    replace_branch_rows(session, DurationStat.__table__, [], [
+        {
+            'branch': branch,
+            'barber_id': barber_id,
+            'service_id': service_id,
+            'hour_band': band,
+            'samples': samples,
+            'mean_minutes': mean,
+            'm2': m2,
+            'ewma_minutes': ewma,
+            'updated_at': now
+        }
+        for (branch, barber_id, service_id, band), (samples, mean, m2, ewma) in stats.items()
+    ])
+    session.commit()
+    return len(stats)
+
+def rebuild_revenue_rollup(start_date, end_date, session=None):
+    """Recompute the revenue rollup for a date range from completed visits"""
+    session = session or db.session
+    start_datetime = datetime.combine(start_date, datetime.min.time())
+    end_datetime = datetime.combine(end_date, datetime.max.time())
+    
+    completed = session.query(
+        CustomerVisit.branch,
+        CustomerVisit.service_id,
+        CustomerVisit.completed_at,
+        CustomerVisit.price_paid
+    ).filter(
+        CustomerVisit.completed_at >= start_datetime,
+        CustomerVisit.completed_at <= end_datetime
+    ).yield_per(1000)
+    
+    totals = {}
+    for record in completed:
+        key = (record.completed_at.date(), record.branch, record.service_id, record.completed_at.hour)
+        revenue, customers = totals.get(key, (0.0, 0))
+        totals[key] = (revenue + float(record.price_paid or 0), customers + 1)
+    
+    table = RevenueRollup.__table__
+    replace_branch_rows(session, table, [table.c.business_date >= start_date, table.c.business_date <= end_date], [
+        {
+            'business_date': business_date,
+            'branch': branch,
+            'service_id': service_id,
+            'hour': hour,
+            'revenue': revenue,
+            'customers': customers
+        }
+        for (business_date, branch, service_id, hour), (revenue, customers) in totals.items()
+    ])
+    session.commit()
+    revenue_days.clear(start_date, end_date)
+    return len(totals)
+
+def get_customer_visit_history(customer_id, limit=10):
+    """Get a customer's most recent visits from the visit table alone"""
+    return CustomerVisit.query.filter_by(customer_id=customer_id).order_by(
+        CustomerVisit.visit_date.desc()
+    ).limit(limit).all()
+
+# Minimum term length the trigram index can match; shorter terms fall back to LIKE
+CUSTOMER_SEARCH_MIN_FTS_LENGTH = 3
+_customer_fts_available = {}
+
+def customer_search_index_available():
+    """Check once per process whether the customer_fts index exists"""
+    if 'available' not in _customer_fts_available:
+        available = False
+        if db.engine.dialect.name == 'sqlite':
+            try:
+                with db.engine.connect() as conn:
+                    available = conn.execute(db.text(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_fts'"
+                    )).first() is not None
+            except SQLAlchemyError:
+                available = False
+        _customer_fts_available['available'] = available
+    return _customer_fts_available['available']
+
+def customer_search_matches(term, limit=None):
+    """Ranked customer_fts matches for a search term, or None when the index can't answer it"""
+    tokens = term.split()
+    if not tokens or any(len(token) < CUSTOMER_SEARCH_MIN_FTS_LENGTH for token in tokens):
+        return None
+    if not customer_search_index_available():
+        return None
     
-    if branch_code:
-        query = query.filter(Customer.branch == branch_code)
+    # Quote every token so user input is never parsed as FTS query syntax
+    match = ' '.join('"' + token.replace('"', '""') + '"' for token in tokens)
+    sql = "SELECT rowid AS customer_id, rank AS search_rank FROM customer_fts WHERE customer_fts MATCH :match ORDER BY rank"
+    params = {'match': match}
+    if limit:
+        sql += " LIMIT :limit"
+        params['limit'] = limit
+    return db.text(sql).bindparams(**params).columns(
+        customer_id=db.Integer, search_rank=db.Float
+    ).subquery('customer_match')
+
+def search_customers(query, term, limit=None):
+    """Filter a Customer query by a search term, best matches first"""
+    matches = customer_search_matches(term, limit)
+    if matches is None:
+        search_filter = f"%{term}%"
+        return query.filter(
+            db.or_(
+                Customer.name.ilike(search_filter),
+                Customer.phone.ilike(search_filter),
+                Customer.email.ilike(search_filter)
+            )
+        )
+    return query.join(matches, Customer.id == matches.c.customer_id).order_by(matches.c.search_rank)
+
+CUSTOMER_IMPORT_CHUNK_SIZE = 2000
+CUSTOMER_IMPORT_MAX_REJECTS_REPORTED = 500
+
+def _validate_import_row(row):
+    """Clean one CSV row into insertable values, or return the reason it is rejected"""
+    name = (row.get('name') or '').strip()
+    phone = (row.get('phone') or '').strip()
+    email = (row.get('email') or '').strip()
+    if not name or not phone:
+        return None, 'Name and phone are required'
+    if len(name) > 100:
+        return None, 'Name is longer than 100 characters'
+    if len(phone) > 20:
+        return None, 'Phone is longer than 20 characters'
+    if email and ('@' not in email or len(email) > 120):
+        return None, 'Invalid email address'
+    return {
+        'name': name,
+        'phone': phone,
+        'email': email or None,
+        'address': (row.get('address') or '').strip() or None,
+        'notes': (row.get('notes') or '').strip() or None
+    }, None
+
+def import_customers(text_stream, branch_code, chunk_size=CUSTOMER_IMPORT_CHUNK_SIZE, progress=None):
+    """Import customers from a CSV stream (name, phone, email, address, notes).
+
+    Rows are read and inserted a chunk at a time: one IN query finds phones
+    that already exist, the new rows go in as a single executemany insert and
+    each chunk is committed on its own. Returns a summary dict.
+    """
+    reader = csv.DictReader(text_stream)
+    if reader.fieldnames:
+        reader.fieldnames = [(field or '').strip().lower() for field in reader.fieldnames]
+    if not reader.fieldnames or 'name' not in reader.fieldnames or 'phone' not in reader.fieldnames:
+        raise ValueError('CSV must have a header row with at least name and phone columns')
+    
+    summary = {'rows': 0, 'imported': 0, 'duplicates': 0, 'rejected': 0, 'rejected_rows': []}
+    seen_phones = set()
+    
+    def reject(line, reason, duplicate=False):
+        summary['duplicates' if duplicate else 'rejected'] += 1
+        if len(summary['rejected_rows']) < CUSTOMER_IMPORT_MAX_REJECTS_REPORTED:
+            summary['rejected_rows'].append({'line': line, 'reason': reason})
+    
+    def flush(chunk):
+        if not chunk:
+            return
+        existing = {
+            row[0] for row in db.session.query(Customer.phone).filter(
+                Customer.phone.in_([values['phone'] for _, values in chunk])
+            )
+        }
+        now = datetime.utcnow()
+        new_rows = []
+        for line, values in chunk:
+            if values['phone'] in existing:
+                reject(line, f"Customer with phone {values['phone']} already exists", duplicate=True)
+                continue
+            values.update(status='registered', total_visits=0, branch=branch_code, created_at=now)
+            new_rows.append(values)
+        if new_rows:
+            db.session.execute(Customer.__table__.insert(), new_rows)
+            mark_branch_changed(branch_code)
+        db.session.commit()
+        summary['imported'] += len(new_rows)
+        if progress:
+            progress(summary)
+    
+    chunk = []
+    for row in reader:
+        summary['rows'] += 1
+        line = reader.line_num
+        values, reason = _validate_import_row(row)
+        if reason:
+            reject(line, reason)
+            continue
+        if values['phone'] in seen_phones:
+            reject(line, f"Phone {values['phone']} appears earlier in the file", duplicate=True)
+            continue
+        seen_phones.add(values['phone'])
+        chunk.append((line, values))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    flush(chunk)
+    
+    if summary['imported']:
+        queue_store.invalidate(branch_code)
+    return summary
+
+def get_franchise_snapshot(target_date=None):
+    """Get queue counts, barbers and revenue for every branch in a constant number of grouped queries"""
+    if not target_date:
+        target_date = business_today()
     
-    return query.group_by(func.extract('hour', Customer.completed_at)).order_by('hour').all()
+    branches_dict = get_branches_dict()
+    branch_stats = {
+        code: {
+            'waiting': 0,
+            'in_progress': 0,
+            'completed_today': 0,
+            'active_barbers': 0,
+            'revenue': 0.0,
+            'revenue_customers': 0
+        }
+        for code in branches_dict
+    }
+    
+    def query_shard(session, branch_codes):
+        query = session.query(
+            RevenueRollup.branch,
+            func.sum(RevenueRollup.revenue),
+            func.sum(RevenueRollup.customers)
+        ).filter(
+            RevenueRollup.business_date == target_date
+        )
+        if branch_codes is not None:
+            query = query.filter(RevenueRollup.branch.in_(branch_codes))
+        return query.group_by(RevenueRollup.branch).all()
+    
+    for revenue_totals in fan_out(query_shard, list(branch_stats)):
+        for branch_code, revenue, customers in revenue_totals:
+            if branch_code in branch_stats:
+                branch_stats[branch_code]['revenue'] = float(revenue or 0)
+                branch_stats[branch_code]['revenue_customers'] = int(customers or 0)
+                branch_stats[branch_code]['completed_today'] = int(customers or 0)
+    
+    # Customers are central: one grouped query for every branch
+    status_counts = db.session.query(
+        Customer.branch,
+        Customer.status,
+        func.count(Customer.id)
+    ).filter(
+        Customer.status.in_(['waiting', 'assigned'])
+    ).group_by(Customer.branch, Customer.status).all()
+    
+    for branch_code, status, count in status_counts:
+        if branch_code in branch_stats:
+            branch_stats[branch_code]['waiting' if status == 'waiting' else 'in_progress'] = count
+    
+    barber_counts = db.session.query(
+        Barber.branch,
+        func.count(Barber.id)
+    ).group_by(Barber.branch).all()
+    
+    for branch_code, count in barber_counts:
+        if branch_code in branch_stats:
+            branch_stats[branch_code]['active_barbers'] = count
+    
+    totals = {
+        'total_waiting': sum(b['waiting'] for b in branch_stats.values()),
+        'total_in_progress': sum(b['in_progress'] for b in branch_stats.values()),
+        'total_completed_today': sum(b['completed_today'] for b in branch_stats.values()),
+        'total_barbers': sum(b['active_barbers'] for b in branch_stats.values()),
+        'total_revenue': sum(b['revenue'] for b in branch_stats.values())
+    }
+    
+    return {
+        'branches': branch_stats,
+        'totals': totals,
+        'date': target_date,
+        'updated_at': datetime.utcnow()
+    }
+
+def next_ticket_sequence(branch_code, business_date):
+    """Take the branch's next daily ticket number in the current transaction, with one upsert"""
+    table = TicketSequence.__table__
+    bind = shard_bind(branch_code)
+    stmt = dialect_insert(table, bind.get('bind')).values(branch=branch_code, business_date=business_date, last_number=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.branch, table.c.business_date],
+        set_={'last_number': table.c.last_number + 1}
+    ).returning(table.c.last_number)
+    return db.session.execute(stmt, bind_arguments=bind).scalar_one()
+
+def format_ticket_number(branch_code, number):
+    return f"{branch_code.upper()}-{number:03d}"
 
 def generate_ticket_number(customer_id, branch_code):
-    """Generate a unique ticket number"""
+    """Ticket number for queue entries made before daily ticket numbers existed"""
     today = datetime.now()
     return f"{branch_code.upper()}-{today.strftime('%m%d')}-{customer_id:04d}"
 
@@ -729,27 +1796,41 @@ def can_remove_customer(customer):
     
     return False, f"Cannot remove customer with status: {customer.status}"
 
+def take_off_queue(customer):
+    """Take a customer off the queue, keeping their profile and completed visit history"""
+    CustomerVisit.query.filter_by(customer_id=customer.id, completed_at=None).delete()
+    stage_queue_event(customer, 'removed')
+    
+    customer.status = 'registered'
+    customer.service_id = None
+    customer.barber_id = None
+    customer.assigned_at = None
+    customer.ticket_number = None
+    # Undo what add_to_queue counted for the visit that never happened
+    customer.total_visits = max(0, (customer.total_visits or 0) - 1)
+    customer.last_visit = db.session.query(func.max(CustomerVisit.visit_date)).filter(
+        CustomerVisit.customer_id == customer.id,
+        CustomerVisit.completed_at.isnot(None)
+    ).scalar()
+
 def get_queue_statistics(branch_code):
     """Get comprehensive queue statistics for a branch"""
+    state = queue_store.snapshot(branch_code)
     stats = {
-        'waiting': Customer.query.filter_by(branch=branch_code, status='waiting').count(),
-        'in_progress': Customer.query.filter_by(branch=branch_code, status='assigned').count(),
-        'completed_today': Customer.query.filter(
-            Customer.branch == branch_code,
-            Customer.status == 'completed',
-            Customer.completed_at >= datetime.now().replace(hour=0, minute=0, second=0)
-        ).count(),
-        'total_customers': Customer.query.filter_by(branch=branch_code).count(),
-        'active_barbers': Barber.query.filter_by(branch=branch_code, is_active=True).count()
+        'waiting': len(state['waiting']),
+        'in_progress': len(state['in_progress']),
+        'completed_today': state['completed_today'],
+        'total_customers': state['total_customers'],
+        'active_barbers': sum(1 for barber in state['barbers'] if barber['is_active'])
     }
     
     # Calculate average wait time
-    waiting_customers = Customer.query.filter_by(branch=branch_code, status='waiting').order_by(Customer.created_at).all()
+    waiting_customers = state['waiting']
     
     if waiting_customers:
         total_wait_time = 0
         for customer in waiting_customers:
-            wait_minutes = (datetime.utcnow() - customer.created_at).total_seconds() / 60
+            wait_minutes = (datetime.utcnow() - (customer.joined_at or customer.created_at)).total_seconds() / 60
             total_wait_time += wait_minutes
         
         stats['avg_wait_time'] = total_wait_time / len(waiting_customers)
@@ -769,7 +1850,6 @@ def log_customer_action(customer_id, action, user_id, details=None):
 def inject_helpers():
     return {
         'now': datetime.now(),
-        'get_wait_time': get_wait_time,
         'BRANCHES': get_branches_dict()
     }
 
@@ -778,46 +1858,157 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def save_customer_photo(file, customer_id=None):
-    """Save uploaded customer photo and return filename"""
-    if file and allowed_file(file.filename):
-        # Generate unique filename
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        if customer_id:
-            filename = f"customer_{customer_id}_{uuid.uuid4().hex[:8]}.{file_extension}"
-        else:
-            filename = f"customer_{uuid.uuid4().hex}.{file_extension}"
-        
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+# Longest edge in pixels for each stored rendition; '' is the main image
+PHOTO_RENDITIONS = {'': 400, 'md': 200, 'sm': 64}
+PHOTO_PENDING_URL = '/static/images/photo-pending.svg'
+
+_photo_pool = None
+_photo_pool_lock = threading.Lock()
+_photo_slots = threading.BoundedSemaphore(app.config['PHOTO_MAX_PENDING'])
+
+def photo_rendition_name(filename, size):
+    """Filename of a photo rendition: customer_1_ab12.jpg -> customer_1_ab12_md.jpg"""
+    if not size:
+        return filename
+    stem, extension = filename.rsplit('.', 1)
+    return f"{stem}_{size}.{extension}"
+
+def stage_customer_photo(file, customer):
+    """Write an upload to the staging area and queue it for processing once the session commits"""
+    if not (file and allowed_file(file.filename)):
+        return False
+    
+    file_extension = file.filename.rsplit('.', 1)[1].lower()
+    staged_name = f"customer_{customer.id}_{uuid.uuid4().hex[:8]}.{file_extension}"
+    staged_path = os.path.join(app.config['PHOTO_STAGING_FOLDER'], staged_name)
+    try:
+        file.save(staged_path)
+    except OSError as e:
+        print(f"Error staging photo: {e}")
+        return False
+    
+    customer.photo_status = 'pending'
+    db.session.info.setdefault('photo_jobs', []).append((customer.id, staged_path))
+    return True
+
+def _photo_executor():
+    global _photo_pool
+    with _photo_pool_lock:
+        if _photo_pool is None:
+            _photo_pool = ThreadPoolExecutor(
+                max_workers=app.config['PHOTO_WORKERS'],
+                thread_name_prefix='photo'
+            )
+        return _photo_pool
+
+def submit_photo_job(customer_id, staged_path):
+    """Hand a staged upload to the worker pool, waiting for a slot when the pool is saturated"""
+    _photo_slots.acquire()
+    try:
+        _photo_executor().submit(_run_photo_job, customer_id, staged_path)
+    except RuntimeError:
+        _photo_slots.release()
+        raise
+
+def _run_photo_job(customer_id, staged_path):
+    try:
+        with app.app_context():
+            process_staged_photo(customer_id, staged_path)
+    except Exception as e:
+        print(f"Photo job for customer {customer_id} failed: {e}")
+    finally:
+        _photo_slots.release()
+
+def render_photo(staged_path, stem):
+    """Decode, orient and resize a staged upload into every rendition; returns the main filename"""
+    use_webp = app.config['PHOTO_WEBP'] and pil_features.check('webp')
+    extension = 'webp' if use_webp else 'jpg'
+    
+    with Image.open(staged_path) as source:
+        image = ImageOps.exif_transpose(source)
+        # Flatten transparency onto white; JPEG has no alpha channel
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
         
-        # Resize and save image
+        # Largest rendition first so each smaller one resamples less data
+        written = []
         try:
-            image = Image.open(file)
-            # Resize to max 400x400 while maintaining aspect ratio
-            image.thumbnail((400, 400), Image.Resampling.LANCZOS)
-            
-            # Convert RGBA to RGB if necessary
-            if image.mode == 'RGBA':
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[-1])
-                image = background
-            
-            image.save(filepath, optimize=True, quality=85)
-            return filename
-        except Exception as e:
-            print(f"Error saving image: {e}")
-            return None
-    return None
+            for size, edge in sorted(PHOTO_RENDITIONS.items(), key=lambda item: -item[1]):
+                image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+                filename = photo_rendition_name(f"{stem}.{extension}", size)
+                path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                if use_webp:
+                    image.save(path, 'WEBP', quality=80, method=4)
+                else:
+                    image.save(path, 'JPEG', optimize=True, quality=85)
+                written.append(filename)
+        except Exception:
+            for filename in written:
+                delete_customer_photo(filename, renditions=False)
+            raise
+    return f"{stem}.{extension}"
 
-def delete_customer_photo(filename):
-    """Delete customer photo file"""
-    if filename:
+def process_staged_photo(customer_id, staged_path):
+    """Produce the renditions for a staged upload and point the customer at them"""
+    stem = os.path.basename(staged_path).rsplit('.', 1)[0]
+    try:
+        filename = render_photo(staged_path, stem)
+    except Exception as e:
+        print(f"Error processing photo for customer {customer_id}: {e}")
+        customer = db.session.get(Customer, customer_id)
+        if customer and customer.photo_status == 'pending':
+            customer.photo_status = 'failed'
+            db.session.commit()
+        return None
+    finally:
         try:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        except Exception as e:
-            print(f"Error deleting photo: {e}")
+            os.remove(staged_path)
+        except OSError:
+            pass
+    
+    customer = db.session.get(Customer, customer_id)
+    if not customer:
+        # Deleted while the photo was processing
+        delete_customer_photo(filename)
+        return None
+    
+    previous = customer.photo_filename
+    customer.photo_filename = filename
+    customer.photo_status = 'ready'
+    db.session.commit()
+    if previous and previous != filename:
+        delete_customer_photo(previous)
+    return filename
+
+@sa_event.listens_for(OrmSession, 'after_commit')
+def _submit_photo_jobs(session):
+    for customer_id, staged_path in session.info.pop('photo_jobs', []):
+        submit_photo_job(customer_id, staged_path)
+
+@sa_event.listens_for(OrmSession, 'after_rollback')
+def _discard_photo_jobs(session):
+    for _, staged_path in session.info.pop('photo_jobs', []):
+        try:
+            os.remove(staged_path)
+        except OSError:
+            pass
+
+def delete_customer_photo(filename, renditions=True):
+    """Delete customer photo file and its renditions"""
+    if filename:
+        names = [photo_rendition_name(filename, size) for size in PHOTO_RENDITIONS] if renditions else [filename]
+        for name in names:
+            try:
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], name)
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            except Exception as e:
+                print(f"Error deleting photo: {e}")
 
 def get_or_create_customer(phone, name=None, email=None, address=None, photo_file=None):
     """Get existing customer by phone or create new one"""
@@ -832,16 +2023,9 @@ def get_or_create_customer(phone, name=None, email=None, address=None, photo_fil
         if address and address.strip():
             customer.address = address.strip()
         
-        # Handle photo update
+        # Handle photo update (the old photo is replaced once the new one is processed)
         if photo_file:
-            # Delete old photo if exists
-            if customer.photo_filename:
-                delete_customer_photo(customer.photo_filename)
-            
-            # Save new photo
-            filename = save_customer_photo(photo_file, customer.id)
-            if filename:
-                customer.photo_filename = filename
+            stage_customer_photo(photo_file, customer)
         
         return customer, False  # False = not newly created
     else:
@@ -863,12 +2047,1299 @@ def get_or_create_customer(phone, name=None, email=None, address=None, photo_fil
         
         # Handle photo
         if photo_file:
-            filename = save_customer_photo(photo_file, customer.id)
-            if filename:
-                customer.photo_filename = filename
+            stage_customer_photo(photo_file, customer)
         
         return customer, True  # True = newly created
 
+# ============================================================================
+# CATALOG CACHE
+# ============================================================================
+
+class CatalogCache:
+    """In-process copy of branches, services and barbers.
+
+    Every worker keeps its own copy and compares it against the catalog_version
+    row at most once per request, reloading when another process (or this one)
+    has changed the catalog. While the cache bus is running the check is skipped
+    and other processes' changes evict the copy instead. Entries are plain dicts
+    and must not be mutated.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+    
+    def _read_version(self):
+        return db.session.execute(
+            db.select(CatalogVersion.version).where(CatalogVersion.id == 1)
+        ).scalar() or 0
+    
+    def _load(self, version):
+        branches = {
+            b.code: {'id': b.id, 'name': b.name, 'address': b.address, 'phone': b.phone, 'is_active': b.is_active,
+                     'auto_dispatch': bool(b.auto_dispatch), 'dispatch_policy': b.dispatch_policy or 'fifo'}
+            for b in Branch.query.order_by(Branch.id)
+        }
+        services = {
+            s.id: {'id': s.id, 'name': s.name, 'duration': s.duration, 'price': s.price, 'is_active': s.is_active}
+            for s in Service.query.order_by(Service.name)
+        }
+        barbers = {
+            b.id: {'id': b.id, 'name': b.name, 'branch': b.branch, 'is_active': b.is_active}
+            for b in Barber.query.order_by(Barber.name)
+        }
+        return {'branches': branches, 'services': services, 'barbers': barbers}
+    
+    def _current(self):
+        data = self._data
+        if has_request_context():
+            # While the cache bus is listening, other workers' catalog changes arrive as evictions
+            if data is not None and (g.get('catalog_checked') or cache_bus.healthy()):
+                return data
+            version = self._read_version()
+            g.catalog_checked = True
+        elif data is not None:
+            return data
+        else:
+            version = self._read_version()
+        
+        with self._lock:
+            if self._data is None or self._version != version:
+                self._data = self._load(version)
+                self._version = version
+            return self._data
+    
+    def invalidate(self):
+        """Force a reload on the next read"""
+        with self._lock:
+            self._data = None
+            self._version = None
+    
+    def version(self):
+        self._current()
+        return self._version
+    
+    def branches(self):
+        return self._current()['branches']
+    
+    def service(self, service_id):
+        return self._current()['services'].get(service_id)
+    
+    def active_services(self):
+        return [s for s in self._current()['services'].values() if s['is_active']]
+    
+    def service_by_name(self, name):
+        for service in self._current()['services'].values():
+            if service['name'] == name:
+                return service
+        return None
+    
+    def barber(self, barber_id):
+        return self._current()['barbers'].get(barber_id)
+    
+    def barbers_for(self, branch_code):
+        return [
+            {'id': b['id'], 'name': b['name'], 'is_active': b['is_active']}
+            for b in self._current()['barbers'].values()
+            if b['branch'] == branch_code
+        ]
+
+catalog = CatalogCache()
+
+def bump_catalog_version():
+    """Mark the catalog changed in the current transaction; every worker reloads after commit"""
+    version = db.session.execute(
+        db.update(CatalogVersion).where(CatalogVersion.id == 1).values(
+            version=CatalogVersion.version + 1,
+            updated_at=datetime.utcnow()
+        ).returning(CatalogVersion.version)
+    ).scalar()
+    if version is None:
+        version = 1
+        db.session.add(CatalogVersion(id=1, version=version))
+    publish_invalidation(db.session, 'catalog', version=version)
+    db.session.info['catalog_changed'] = True
+
+# ============================================================================
+# LIVE QUEUE STATE
+# ============================================================================
+
+# One live queue entry, flat so templates never touch a relationship. position, wait_minutes
+# and wait_time are only filled on the waiting rows an estimate returns.
+QueueRow = namedtuple('QueueRow', [
+    'id', 'name', 'phone', 'notes', 'branch', 'status', 'created_at', 'joined_at', 'assigned_at', 'completed_at',
+    'service_id', 'service_name', 'service_price', 'service_duration', 'barber_id', 'barber_name',
+    'ticket_number', 'position', 'wait_minutes', 'wait_time'
+], defaults=(None,) * 19)
+
+def load_queue_rows(*criteria):
+    """Fetch queue rows matching criteria with the service and barber joined in one query"""
+    rows = db.session.query(
+        Customer.id, Customer.name, Customer.phone, Customer.notes, Customer.branch, Customer.status,
+        Customer.created_at, func.coalesce(Customer.last_visit, Customer.created_at),
+        Customer.assigned_at, Customer.completed_at,
+        Customer.service_id, Service.name, Service.price, Service.duration,
+        Customer.barber_id, Barber.name, Customer.ticket_number
+    ).outerjoin(Service, Service.id == Customer.service_id) \
+     .outerjoin(Barber, Barber.id == Customer.barber_id) \
+     .filter(*criteria).all()
+    return [QueueRow(*row) for row in rows]
+
+def snapshot_queue_entry(customer):
+    """Build the queue row for a Customer that was just changed in this session"""
+    service = catalog.service(customer.service_id) if customer.service_id else None
+    if service is None and customer.service:
+        service = {'name': customer.service.name, 'price': customer.service.price,
+                   'duration': customer.service.duration}
+    barber = catalog.barber(customer.barber_id) if customer.barber_id else None
+    if barber is None and customer.barber:
+        barber = {'name': customer.barber.name}
+    return QueueRow(
+        id=customer.id,
+        name=customer.name,
+        phone=customer.phone,
+        notes=customer.notes,
+        branch=customer.branch,
+        status=customer.status,
+        created_at=customer.created_at,
+        joined_at=customer.last_visit or customer.created_at,
+        assigned_at=customer.assigned_at,
+        completed_at=customer.completed_at,
+        service_id=customer.service_id,
+        service_name=service['name'] if service else None,
+        service_price=service['price'] if service else None,
+        service_duration=service['duration'] if service else None,
+        barber_id=customer.barber_id,
+        barber_name=barber['name'] if barber else None,
+        ticket_number=customer.ticket_number
+    )
+
+class DurationEstimates:
+    """Learned service times for one branch, read from duration_stats.
+
+    A barber's own average for the service and hour band is used once it has
+    enough samples, then the branch-wide average for the service, then the
+    catalog duration.
+    """
+    
+    def __init__(self, rows, min_samples):
+        self.loaded_at = time.monotonic()
+        self._by_barber = {}
+        totals = {}
+        for row in rows:
+            if row.samples >= min_samples:
+                self._by_barber[(row.barber_id, row.service_id, row.hour_band)] = row.ewma_minutes
+            total = totals.setdefault((row.service_id, row.hour_band), [0, 0.0])
+            total[0] += row.samples
+            total[1] += row.samples * row.ewma_minutes
+        self._by_service = {key: weighted / samples for key, (samples, weighted) in totals.items()
+                            if samples >= min_samples}
+    
+    def minutes(self, entry, band):
+        if entry.barber_id:
+            learned = self._by_barber.get((entry.barber_id, entry.service_id, band))
+            if learned is not None:
+                return learned
+        learned = self._by_service.get((entry.service_id, band))
+        return learned if learned is not None else (entry.service_duration or 0)
+
+def load_duration_estimates(branch_code):
+    def query_shard(session, branch_codes):
+        return session.query(
+            DurationStat.barber_id, DurationStat.service_id, DurationStat.hour_band,
+            DurationStat.samples, DurationStat.ewma_minutes
+        ).filter(DurationStat.branch == branch_code).all()
+    
+    rows, = fan_out(query_shard, [branch_code])
+    return DurationEstimates(rows, app.config['DURATION_MIN_SAMPLES'])
+
+def estimate_waits(waiting, in_progress, barber_ids, now, durations=None):
+    """Estimate queue position and wait for each waiting entry in one ordered pass.
+
+    Each active barber is treated as a parallel server. A busy barber becomes
+    free when the remaining time of their current service runs out, and each
+    waiting customer starts on the first chair to free up. Service times come
+    from durations (learned statistics) when given, else the catalog.
+    """
+    def service_minutes(entry, band):
+        return durations.minutes(entry, band) if durations else (entry.service_duration or 0)
+    
+    # Minutes until each chair is free, seeded with in-progress remaining time
+    chair_free_in = {barber_id: 0 for barber_id in barber_ids}
+    for entry in in_progress:
+        duration = service_minutes(entry, hour_band(entry.assigned_at or now))
+        elapsed = (now - entry.assigned_at).total_seconds() / 60 if entry.assigned_at else 0
+        remaining = max(0, duration - elapsed)
+        chair_free_in[entry.barber_id] = chair_free_in.get(entry.barber_id, 0) + remaining
+    
+    chairs = list(chair_free_in.values()) or [0]
+    heapq.heapify(chairs)
+    
+    band = hour_band(now)
+    positions = {}
+    wait_minutes = {}
+    for position, entry in enumerate(waiting, start=1):
+        start_in = heapq.heappop(chairs)
+        positions[entry.id] = position
+        wait_minutes[entry.id] = int(round(start_in))
+        heapq.heappush(chairs, start_in + service_minutes(entry, band))
+    
+    return positions, wait_minutes
+
+def queue_order(entry):
+    """Sort key for waiting entries: when they joined this visit, ties broken by id"""
+    return (entry.joined_at or entry.created_at, entry.id)
+
+def _insert_by_arrival(entries, entry):
+    """Insert a queue entry keeping the list ordered by arrival"""
+    index = len(entries)
+    key = queue_order(entry)
+    while index > 0 and queue_order(entries[index - 1]) > key:
+        index -= 1
+    entries.insert(index, entry)
+
+class BranchQueueState:
+    """Ordered waiting and in-progress entries plus counters for one branch"""
+    
+    def __init__(self, branch_code):
+        self.branch_code = branch_code
+        self.waiting = []
+        self.in_progress = []
+        self.barbers = []
+        self.completed_today = 0
+        self.total_customers = 0
+        self.business_date = business_today()
+        self.durations = None
+        self.version = 0
+        self.db_version = 0  # the branch_state_version row this state reflects
+
+class QueueStateStore:
+    """In-process live queue state per branch, updated write-through on commit.
+
+    A branch is loaded from the database the first time it is read. After that,
+    queue mutations are applied to the in-memory lists in place. If an update
+    does not match what the store holds (a customer missing from the list it
+    should be in, or the business day rolling over) the branch is dropped and
+    rebuilt on its next read. Reads compare the branch's persisted state version
+    with the one the state was built from, so a change committed by another
+    worker triggers a rebuild (skipped while the cache bus delivers evictions).
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._branches = {}
+    
+    def _load(self, branch_code):
+        state = BranchQueueState(branch_code)
+        # Read the version first: a commit racing the load only causes one extra rebuild
+        state.db_version = get_branch_versions([branch_code]).get(branch_code, 0)
+        
+        entries = load_queue_rows(Customer.branch == branch_code, Customer.status.in_(['waiting', 'assigned']))
+        state.waiting = sorted((e for e in entries if e.status == 'waiting'), key=queue_order)
+        state.in_progress = sorted((e for e in entries if e.status == 'assigned'),
+                                   key=lambda e: e.assigned_at or e.created_at)
+        
+        state.barbers = catalog.barbers_for(branch_code)
+        state.completed_today = Customer.query.filter(
+            Customer.branch == branch_code,
+            Customer.status == 'completed',
+            Customer.completed_at >= datetime.combine(state.business_date, datetime.min.time())
+        ).count()
+        state.total_customers = Customer.query.filter_by(branch=branch_code).count()
+        state.durations = load_duration_estimates(branch_code)
+        return state
+    
+    def _get(self, branch_code, refresh=True):
+        state = self._branches.get(branch_code)
+        if state is None or state.business_date != business_today() or (
+                refresh and not cache_bus.healthy()
+                and get_branch_versions([branch_code]).get(branch_code, 0) != state.db_version):
+            state = self._load(branch_code)
+            self._branches[branch_code] = state
+        elif refresh and \
+                time.monotonic() - state.durations.loaded_at > app.config['DURATION_STATS_REFRESH_SECONDS']:
+            state.durations = load_duration_estimates(branch_code)
+        return state
+    
+    def sync_version(self, branch_code, version):
+        """Drop a branch whose state was built from a different persisted version than the one just read"""
+        with self._lock:
+            state = self._branches.get(branch_code)
+            if state is None or state.db_version == version:
+                return
+            del self._branches[branch_code]
+        queue_events.publish_resync(branch_code)
+    
+    def rebuild(self, branch_code):
+        """Reload one branch from the database"""
+        with self._lock:
+            self._branches[branch_code] = self._load(branch_code)
+    
+    def rebuild_all(self):
+        """Reload every branch from the database"""
+        with self._lock:
+            self._branches = {}
+            for code in catalog.branches():
+                self._branches[code] = self._load(code)
+    
+    def invalidate(self, branch_code=None):
+        """Drop one branch (or all) so the next read reloads from the database"""
+        with self._lock:
+            if branch_code is None:
+                self._branches = {}
+            else:
+                self._branches.pop(branch_code, None)
+        queue_events.publish_resync(branch_code)
+    
+    def snapshot(self, branch_code, refresh=True):
+        """Get a consistent copy of a branch's live queue state (refresh=False never queries the database)"""
+        with self._lock:
+            state = self._get(branch_code, refresh)
+            return {
+                'waiting': list(state.waiting),
+                'in_progress': list(state.in_progress),
+                'barbers': list(state.barbers),
+                'completed_today': state.completed_today,
+                'total_customers': state.total_customers,
+                'durations': state.durations,
+                'version': state.version
+            }
+    
+    def estimate(self, branch_code, now=None, refresh=True):
+        """Get the live queue with positions and estimated waits filled in on the waiting rows"""
+        if now is None:
+            now = datetime.utcnow()
+        state = self.snapshot(branch_code, refresh)
+        barber_ids = [b['id'] for b in state['barbers'] if b['is_active']]
+        positions, wait_minutes = estimate_waits(state['waiting'], state['in_progress'], barber_ids, now,
+                                                 state['durations'])
+        wait_times = {cid: format_wait_time(m) for cid, m in wait_minutes.items()}
+        
+        state.update({
+            'waiting': [e._replace(position=positions[e.id], wait_minutes=wait_minutes[e.id],
+                                   wait_time=wait_times[e.id]) for e in state['waiting']],
+            'positions': positions,
+            'wait_minutes': wait_minutes,
+            'wait_times': wait_times,
+            'active_barbers': len(barber_ids)
+        })
+        return state
+    
+    def apply(self, event, entry, previous_branch=None, versions=None):
+        """Apply a committed queue change to the in-memory state; versions are the branch versions it committed"""
+        versions = versions or {}
+        with self._lock:
+            branch_code = entry.branch
+            state = self._branches.get(branch_code)
+            if state is None:
+                # Not loaded yet; the next read will pick the change up from the database
+                queue_events.publish_resync(branch_code)
+                return
+            
+            if not self._apply_to_state(state, event, entry, previous_branch):
+                self._branches.pop(branch_code, None)
+                queue_events.publish_resync(branch_code)
+                return
+            state.version += 1
+            state.db_version = versions.get(branch_code, state.db_version)
+            # Runs after commit, when the session cannot query; statistics refresh on the next read
+            queue_events.publish(branch_code, event, entry.id, self.estimate(branch_code, refresh=False))
+            
+            if event == 'added' and previous_branch and previous_branch != branch_code:
+                previous_state = self._branches.get(previous_branch)
+                if previous_state is not None:
+                    previous_state.total_customers -= 1
+                    previous_state.version += 1
+                    previous_state.db_version = versions.get(previous_branch, previous_state.db_version)
+    
+    def _apply_to_state(self, state, event, entry, previous_branch):
+        """Mutate state for one event; returns False when the state has drifted"""
+        if state.business_date != business_today():
+            return False
+        
+        waiting_index = next((i for i, e in enumerate(state.waiting) if e.id == entry.id), None)
+        in_progress_index = next((i for i, e in enumerate(state.in_progress) if e.id == entry.id), None)
+        
+        if event == 'added':
+            if waiting_index is not None or in_progress_index is not None:
+                return False
+            _insert_by_arrival(state.waiting, entry)
+            if previous_branch != state.branch_code:
+                state.total_customers += 1
+        elif event == 'assigned':
+            if waiting_index is None:
+                return False
+            del state.waiting[waiting_index]
+            state.in_progress.append(entry)
+        elif event == 'completed':
+            if in_progress_index is None:
+                return False
+            del state.in_progress[in_progress_index]
+            state.completed_today += 1
+            state.durations.loaded_at = 0  # reload on the next read to pick up the service time just recorded
+        elif event == 'cancelled':
+            if in_progress_index is None:
+                return False
+            del state.in_progress[in_progress_index]
+            _insert_by_arrival(state.waiting, entry)
+        elif event == 'removed':
+            if waiting_index is not None:
+                del state.waiting[waiting_index]
+            elif in_progress_index is not None:
+                del state.in_progress[in_progress_index]
+            else:
+                return False
+        else:
+            return False
+        return True
+
+queue_store = QueueStateStore()
+
+def estimate_queue(branch_code, now=None):
+    """Estimate queue position and wait time for every active customer in a branch"""
+    return queue_store.estimate(branch_code, now)
+
+def stage_queue_event(customer, event, previous_branch=None):
+    """Record a queue change to be applied to the live state when the session commits"""
+    db.session.info.setdefault('queue_events', []).append((event, customer, previous_branch))
+
+def mark_branch_changed(branch_code):
+    """Bump the branch's state version when the session commits, for changes made outside queue events"""
+    if branch_code:
+        db.session.info.setdefault('changed_branches', set()).add(branch_code)
+
+def bump_branch_versions(session, branch_codes):
+    """Increment each branch's state version; returns {branch: new version}"""
+    table = BranchStateVersion.__table__
+    versions = {}
+    for branch_code in sorted(branch_codes):
+        stmt = dialect_insert(table).values(branch=branch_code, version=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.branch],
+            set_={'version': table.c.version + 1}
+        ).returning(table.c.version)
+        versions[branch_code] = session.execute(stmt).scalar_one()
+        publish_invalidation(session, 'queue', branch_code, versions[branch_code])
+    return versions
+
+def get_branch_versions(branch_codes=None):
+    """Get {branch: state version}; branches that never changed are at 0"""
+    query = db.session.query(BranchStateVersion.branch, BranchStateVersion.version)
+    if branch_codes is not None:
+        query = query.filter(BranchStateVersion.branch.in_(branch_codes))
+    return dict(query.all())
+
+@sa_event.listens_for(OrmSession, 'before_commit')
+def _snapshot_queue_events(session):
+    changed_branches = session.info.pop('changed_branches', set())
+    staged = session.info.pop('queue_events', None)
+    if not staged:
+        if changed_branches:
+            bump_branch_versions(session, changed_branches)
+        return
+    
+    session.flush()
+    ready = session.info.setdefault('queue_events_ready', [])
+    for event, customer, previous_branch in staged:
+        if event == 'removed':
+            entry = QueueRow(id=customer.id, branch=customer.branch)
+        else:
+            entry = snapshot_queue_entry(customer)
+        ready.append((event, entry, previous_branch))
+        changed_branches.add(customer.branch)
+        if previous_branch:
+            changed_branches.add(previous_branch)
+    session.info['branch_versions_ready'] = bump_branch_versions(session, changed_branches)
+
+@sa_event.listens_for(OrmSession, 'after_commit')
+def _apply_queue_events(session):
+    if session.info.pop('catalog_changed', False):
+        catalog.invalidate()
+    versions = session.info.pop('branch_versions_ready', {})
+    for event, entry, previous_branch in session.info.pop('queue_events_ready', []):
+        queue_store.apply(event, entry, previous_branch, versions)
+        record_queue_metrics(event, entry)
+
+@sa_event.listens_for(OrmSession, 'after_rollback')
+def _discard_queue_events(session):
+    session.info.pop('queue_events', None)
+    session.info.pop('queue_events_ready', None)
+    session.info.pop('branch_versions_ready', None)
+    session.info.pop('catalog_changed', None)
+    session.info.pop('changed_branches', None)
+
+# ============================================================================
+# AUTO-DISPATCH
+# ============================================================================
+
+# name -> (label, rank). rank(waiting, barber_id, context) orders the waiting rows
+# (given in arrival order) by who the free barber should take next.
+DISPATCH_POLICIES = {}
+
+def dispatch_policy(name, label):
+    def register(rank):
+        DISPATCH_POLICIES[name] = (label, rank)
+        return rank
+    return register
+
+class DispatchContext:
+    """What the ranking policies read during one dispatch pass, loaded at most once.
+
+    Each free barber ranks the same waiting customers, so the duration
+    estimates and last-barber lookups are fetched on first use and reused.
+    """
+    
+    def __init__(self, branch_code, waiting, now):
+        self.branch_code = branch_code
+        self.band = hour_band(now)
+        self._customer_ids = [row.id for row in waiting]
+        self._durations = None
+        self._last_barbers = None
+    
+    @property
+    def durations(self):
+        if self._durations is None:
+            self._durations = load_duration_estimates(self.branch_code)
+        return self._durations
+    
+    @property
+    def last_barbers(self):
+        """customer id -> barber of their latest completed visit"""
+        if self._last_barbers is None:
+            last_visit = db.session.query(
+                CustomerVisit.customer_id, func.max(CustomerVisit.completed_at).label('completed_at')
+            ).filter(
+                CustomerVisit.customer_id.in_(self._customer_ids),
+                CustomerVisit.completed_at.isnot(None)
+            ).group_by(CustomerVisit.customer_id).subquery()
+            self._last_barbers = dict(db.session.query(CustomerVisit.customer_id, CustomerVisit.barber_id).join(
+                last_visit, and_(CustomerVisit.customer_id == last_visit.c.customer_id,
+                                 CustomerVisit.completed_at == last_visit.c.completed_at)
+            ).all())
+        return self._last_barbers
+
+@dispatch_policy('fifo', 'First come, first served')
+def _rank_first_come(waiting, barber_id, context):
+    return list(waiting)
+
+@dispatch_policy('shortest_service', 'Shortest service first')
+def _rank_shortest_service(waiting, barber_id, context):
+    durations = context.durations
+    # sorted() is stable, so equal services keep their arrival order
+    return sorted(waiting, key=lambda row: durations.minutes(row._replace(barber_id=barber_id), context.band))
+
+@dispatch_policy('preferred_barber', "Customer's last barber first")
+def _rank_preferred_barber(waiting, barber_id, context):
+    last_barbers = context.last_barbers
+    regulars = {row.id for row in waiting if last_barbers.get(row.id) == barber_id}
+    return [row for row in waiting if row.id in regulars] + [row for row in waiting if row.id not in regulars]
+
+def claim_customer(customer_id, barber_id, now, require_idle_barber=True):
+    """Move a waiting customer to a barber with one conditional UPDATE.
+
+    Returns the customer, or None when the customer is no longer waiting (or,
+    with require_idle_barber, the barber is already busy) because another
+    request or worker got there first.
+    """
+    conditions = [Customer.id == customer_id, Customer.status == 'waiting']
+    if require_idle_barber:
+        # Row lock on databases with FOR UPDATE, so two transactions cannot both seat this chair
+        db.session.query(Barber.id).filter(Barber.id == barber_id).with_for_update().first()
+        busy = aliased(Customer)
+        conditions.append(~select(busy.id).where(busy.barber_id == barber_id, busy.status == 'assigned').exists())
+    
+    result = db.session.execute(
+        update(Customer).where(*conditions).values(status='assigned', barber_id=barber_id, assigned_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return None
+    
+    customer = db.session.get(Customer, customer_id, populate_existing=True)
+    visit = CustomerVisit.open_for(customer)
+    if visit:
+        visit.barber_id = barber_id
+        visit.assigned_at = now
+    stage_queue_event(customer, 'assigned')
+    return customer
+
+def dispatch_waiting_customers(branch_code, skip=None):
+    """Seat waiting customers with every free barber of an auto-dispatch branch and commit.
+
+    skip is a (customer_id, barber_id) pair not to match again, e.g. a cancelled
+    service. Returns [(customer name, barber name)] for the assignments made.
+    """
+    branch = catalog.branches().get(branch_code)
+    if not branch or not branch['auto_dispatch']:
+        return []
+    _, rank = DISPATCH_POLICIES.get(branch['dispatch_policy'], DISPATCH_POLICIES['fifo'])
+    now = datetime.utcnow()
+    
+    busy = {barber_id for barber_id, in db.session.query(Customer.barber_id).filter(
+        Customer.branch == branch_code, Customer.status == 'assigned')}
+    free = [b for b in catalog.barbers_for(branch_code) if b['is_active'] and b['id'] not in busy]
+    if not free:
+        return []
+    waiting = sorted(load_queue_rows(Customer.branch == branch_code, Customer.status == 'waiting'),
+                     key=queue_order)
+    if not waiting:
+        return []
+    
+    # The barber who has been free the longest goes first
+    last_finished = dict(db.session.query(CustomerVisit.barber_id, func.max(CustomerVisit.completed_at)).filter(
+        CustomerVisit.barber_id.in_([b['id'] for b in free])
+    ).group_by(CustomerVisit.barber_id).all())
+    free.sort(key=lambda b: last_finished.get(b['id']) or datetime.min)
+    
+    max_wait = timedelta(minutes=app.config['DISPATCH_MAX_WAIT_MINUTES'])
+    context = DispatchContext(branch_code, waiting, now)
+    assignments = []
+    try:
+        for barber in free:
+            overdue = [row for row in waiting if row.joined_at and now - row.joined_at > max_wait]
+            overdue_ids = {row.id for row in overdue}
+            candidates = overdue + [row for row in rank(waiting, barber['id'], context) if row.id not in overdue_ids]
+            for row in candidates:
+                if skip == (row.id, barber['id']):
+                    continue
+                customer = claim_customer(row.id, barber['id'], now)
+                waiting = [other for other in waiting if other.id != row.id]
+                if customer:
+                    assignments.append((customer.name, barber['name']))
+                # On a lost race another worker is dispatching this branch too; leave this barber to it
+                break
+            if not waiting:
+                break
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"Auto-dispatch for {branch_code} failed: {e}")
+        return []
+    return assignments
+
+def flash_dispatched(assignments):
+    for customer_name, barber_name in assignments:
+        flash(f'{customer_name} auto-assigned to {barber_name}.', 'info')
+
+# ============================================================================
+# QUEUE EVENT STREAM (Server-Sent Events)
+# ============================================================================
+
+def serialize_queue_entry(entry, include_private):
+    """Convert a live queue row to JSON for the event stream"""
+    data = {
+        'id': entry.id,
+        'name': entry.name,
+        'service_name': entry.service_name,
+        'service_price': entry.service_price,
+        'service_duration': entry.service_duration,
+        'barber_name': entry.barber_name,
+        'ticket_number': entry.ticket_number,
+        'created_at': entry.created_at.strftime('%H:%M') if entry.created_at else None,
+        'assigned_at': entry.assigned_at.strftime('%H:%M') if entry.assigned_at else None,
+        'position': entry.position,
+        'wait_time': entry.wait_time
+    }
+    if include_private:
+        data['phone'] = entry.phone
+        data['notes'] = entry.notes
+    return data
+
+def serialize_queue(queue, include_private):
+    """Convert a queue estimate to JSON for the event stream"""
+    return {
+        'waiting': [serialize_queue_entry(e, include_private) for e in queue['waiting']],
+        'in_progress': [serialize_queue_entry(e, include_private) for e in queue['in_progress']],
+        'completed_today': queue['completed_today']
+    }
+
+class QueueEventBroker:
+    """Fan committed queue events out to stream subscribers.
+
+    Each branch keeps a short replay buffer so a reconnecting client can resume
+    from its Last-Event-ID. Event ids carry a per-process epoch, so ids from a
+    previous process (or ones that have fallen out of the buffer) trigger a
+    full sync instead of a replay.
+    """
+    
+    def __init__(self, buffer_size):
+        self._condition = threading.Condition()
+        self._buffer_size = buffer_size
+        self._events = {}
+        self._sequence = {}
+        self.epoch = uuid.uuid4().hex[:8]
+    
+    def _append(self, branch_code, record):
+        with self._condition:
+            sequence = self._sequence.get(branch_code, 0) + 1
+            self._sequence[branch_code] = sequence
+            record['seq'] = sequence
+            record['id'] = f"{self.epoch}-{sequence}"
+            buffer = self._events.get(branch_code)
+            if buffer is None:
+                buffer = self._events[branch_code] = deque(maxlen=self._buffer_size)
+            buffer.append(record)
+            self._condition.notify_all()
+    
+    def publish(self, branch_code, event, customer_id, queue):
+        """Publish a queue change together with the branch's updated queue"""
+        self._append(branch_code, {
+            'event': event,
+            'public': json.dumps({'event': event, 'customer_id': customer_id, 'queue': serialize_queue(queue, False)}),
+            'private': json.dumps({'event': event, 'customer_id': customer_id, 'queue': serialize_queue(queue, True)})
+        })
+    
+    def publish_resync(self, branch_code=None):
+        """Tell subscribers to rebuild their view from the live queue state"""
+        branch_codes = [branch_code] if branch_code else list(self._sequence)
+        for code in branch_codes:
+            self._append(code, {'event': 'resync'})
+    
+    def current_sequence(self, branch_code):
+        with self._condition:
+            return self._sequence.get(branch_code, 0)
+    
+    def resume_sequence(self, branch_code, last_event_id):
+        """Get the sequence to replay from, or None when the client must resync"""
+        if not last_event_id:
+            return None
+        epoch, _, sequence = last_event_id.partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        with self._condition:
+            buffer = self._events.get(branch_code)
+            oldest = buffer[0]['seq'] if buffer else self._sequence.get(branch_code, 0) + 1
+            if sequence > self._sequence.get(branch_code, 0) or sequence < oldest - 1:
+                return None
+        return sequence
+    
+    def wait_for_events(self, branch_code, after_sequence, timeout):
+        """Block until events newer than after_sequence exist (or timeout); return them"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence.get(branch_code, 0) > after_sequence, timeout)
+            buffer = self._events.get(branch_code, ())
+            if buffer and buffer[0]['seq'] > after_sequence + 1:
+                # The subscriber fell behind the replay buffer
+                return [{'event': 'resync', 'seq': buffer[-1]['seq'], 'id': buffer[-1]['id']}]
+            return [record for record in buffer if record['seq'] > after_sequence]
+
+queue_events = QueueEventBroker(app.config['SSE_REPLAY_BUFFER'])
+
+def format_sse(event, data, event_id=None):
+    """Format one Server-Sent Events message"""
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+# ============================================================================
+# CACHE INVALIDATION BUS
+# ============================================================================
+
+_HOSTNAME = socket.gethostname()
+
+def process_origin():
+    """Identify this process in the change log (forked workers share module state, so read the pid each time)"""
+    return f"{_HOSTNAME}:{os.getpid()}"
+
+def publish_invalidation(session, topic, branch_code=None, version=None):
+    """Record a cache change in the session's transaction; other processes evict once it commits"""
+    if not app.config['CACHE_BUS_ENABLED']:
+        return
+    session.execute(CacheInvalidation.__table__.insert().values(
+        topic=topic,
+        branch=branch_code,
+        version=version,
+        origin=process_origin(),
+        created_at=datetime.utcnow()
+    ))
+
+def broadcast_invalidation(topic, branch_code=None):
+    """Publish a cache change on its own, for bulk jobs that bypass the write-through paths"""
+    publish_invalidation(db.session, topic, branch_code)
+    db.session.commit()
+
+class CacheInvalidationBus:
+    """Evicts this process's in-memory caches when another process commits a change.
+
+    Writers add (topic, branch, version) rows to cache_invalidation in the same
+    transaction as the change. Every process reads the rows after its cursor on a
+    background thread and drops the affected queue state, catalog or revenue
+    days; its own rows are skipped, since write-through already updated it. If the
+    listener falls further behind than the log's retention, everything is dropped.
+    The poll interval doubles while other processes change nothing, up to
+    CACHE_BUS_MAX_POLL_MS, and drops back as soon as a change arrives.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._cursor = None
+        self._seen = {}  # id -> created_at of rows inside the grace window
+        self._last_poll = 0
+        # Spread the workers' prunes over the retention window instead of all pruning together
+        self._last_prune = time.monotonic() - random.uniform(0, app.config['CACHE_BUS_RETENTION_SECONDS'])
+    
+    def start(self):
+        """Start the listener thread once per process (threads do not survive a fork)"""
+        if not app.config['CACHE_BUS_ENABLED'] or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._cursor = None
+            self._thread = threading.Thread(target=self._run, name='cache-bus', daemon=True)
+            self._thread.start()
+    
+    def healthy(self):
+        """True while this process's listener is running and polled recently"""
+        return (self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+                and time.monotonic() - self._last_poll < 1 + 3 * app.config['CACHE_BUS_MAX_POLL_MS'] / 1000)
+    
+    def _run(self):
+        interval = app.config['CACHE_BUS_POLL_MS']
+        while True:
+            applied = 0
+            try:
+                with app.app_context():
+                    applied = self.poll()
+            except Exception as e:
+                print(f"Cache bus error: {e}")
+            if applied:
+                interval = app.config['CACHE_BUS_POLL_MS']
+            else:
+                interval = min(interval * 2, app.config['CACHE_BUS_MAX_POLL_MS'])
+            time.sleep(interval / 1000)
+    
+    def poll(self):
+        """Evict whatever other processes changed since the last poll; returns the number of changes applied"""
+        try:
+            now = datetime.utcnow()
+            if self._cursor is None:
+                self._cursor = db.session.query(func.max(CacheInvalidation.id)).scalar() or 0
+                # Anything cached before the cursor was taken may already be stale
+                self._evict_all()
+            elif time.monotonic() - self._last_poll > app.config['CACHE_BUS_RETENTION_SECONDS']:
+                print("⚠️ Cache bus fell behind the change log; dropping all cached state")
+                self._evict_all()
+            
+            since = now - timedelta(seconds=app.config['CACHE_BUS_GRACE_SECONDS'])
+            rows = db.session.query(
+                CacheInvalidation.id, CacheInvalidation.topic, CacheInvalidation.branch,
+                CacheInvalidation.origin, CacheInvalidation.created_at
+            ).filter(
+                or_(CacheInvalidation.id > self._cursor, CacheInvalidation.created_at >= since)
+            ).order_by(CacheInvalidation.id).all()
+            
+            if time.monotonic() - self._last_prune > app.config['CACHE_BUS_RETENTION_SECONDS']:
+                self._last_prune = time.monotonic()
+                db.session.query(CacheInvalidation).filter(
+                    CacheInvalidation.created_at < now - timedelta(seconds=app.config['CACHE_BUS_RETENTION_SECONDS'])
+                ).delete(synchronize_session=False)
+                db.session.commit()
+        finally:
+            db.session.close()
+        
+        origin = process_origin()
+        applied = 0
+        for row_id, topic, branch_code, row_origin, created_at in rows:
+            self._cursor = max(self._cursor, row_id)
+            if row_id in self._seen:
+                continue
+            self._seen[row_id] = created_at
+            if row_origin != origin:
+                self._evict(topic, branch_code)
+                applied += 1
+        self._seen = {row_id: created_at for row_id, created_at in self._seen.items() if created_at >= since}
+        self._last_poll = time.monotonic()
+        return applied
+    
+    def _evict(self, topic, branch_code):
+        cache_invalidations_total.inc(topic)
+        if topic == 'queue':
+            queue_store.invalidate(branch_code)
+        elif topic == 'catalog':
+            # Queue rows carry barber and service names and prices
+            catalog.invalidate()
+            queue_store.invalidate()
+        elif topic == 'revenue':
+            revenue_days.clear()
+    
+    def _evict_all(self):
+        catalog.invalidate()
+        queue_store.invalidate()
+        revenue_days.clear()
+
+cache_bus = CacheInvalidationBus()
+
+@app.before_request
+def start_cache_bus():
+    cache_bus.start()
+
+# ============================================================================
+# REQUEST INSTRUMENTATION
+# ============================================================================
+
+# Collapses expanded IN lists so "IN (?, ?)" and "IN (?, ?, ?)" count as one statement shape
+_IN_LIST_PATTERN = re.compile(r'\(\s*(?:\?|%\(\w+\)s)(?:\s*,\s*(?:\?|%\(\w+\)s))*\s*\)')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def statement_shape(statement):
+    """Normalise a SQL statement so repeats with different parameters compare equal"""
+    return _IN_LIST_PATTERN.sub('(?)', _WHITESPACE_PATTERN.sub(' ', statement).strip())
+
+class RequestLog:
+    """Ring buffer of recent per-request timings for /debug/requests"""
+    
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=size)
+    
+    def append(self, record):
+        with self._lock:
+            self._records.append(record)
+    
+    def recent(self, limit=None):
+        with self._lock:
+            records = list(self._records)
+        records.reverse()
+        return records[:limit] if limit else records
+
+request_log = RequestLog(app.config['DEBUG_REQUEST_BUFFER'])
+
+def _request_sql_stats():
+    """SQL stats of the current request, or None outside requests (background threads, CLI)"""
+    if not has_request_context():
+        return None
+    return g.get('sql_stats')
+
+@sa_event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if _request_sql_stats() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@sa_event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_sql_stats()
+    started = conn.info.get('query_started')
+    if stats is None or not started:
+        return
+    stats['db_ms'] += (time.perf_counter() - started.pop()) * 1000
+    stats['queries'] += 1
+    shape = statement_shape(statement)
+    stats['shapes'][shape] = stats['shapes'].get(shape, 0) + 1
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_started = time.perf_counter()
+    if app.config['SQL_INSTRUMENTATION']:
+        g.sql_stats = {'queries': 0, 'db_ms': 0.0, 'shapes': {}}
+
+@app.after_request
+def finish_request_instrumentation(response):
+    """Add Server-Timing, log the request and warn about repeated statements (N+1 queries)"""
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+    g.sql_stats = None  # queries made while the response streams are not this request's
+    total_ms = (time.perf_counter() - g.request_started) * 1000
+    if app.config['SERVER_TIMING_PUBLIC'] or current_user.is_authenticated:
+        response.headers.add('Server-Timing', f'db;dur={stats["db_ms"]:.1f};desc="{stats["queries"]} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+    if request.endpoint in ('static', 'debug_requests'):
+        return response
+    # The URL rule, never the raw path: paths and query strings carry reset tokens, names and phone numbers
+    route = request.url_rule.rule if request.url_rule else None
+    
+    threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    repeated = sorted(((count, shape) for shape, count in stats['shapes'].items() if count > 1), reverse=True)
+    for count, shape in repeated:
+        if count <= threshold:
+            break
+        print(f"⚠️ Possible N+1 in {request.endpoint} ({request.method} {route}): "
+              f"{count}x {shape[:200]}")
+    
+    request_log.append({
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'method': request.method,
+        'route': route,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(total_ms, 1),
+        'queries': stats['queries'],
+        'db_ms': round(stats['db_ms'], 1),
+        'n_plus_one': bool(repeated) and repeated[0][0] > threshold,
+        'repeated': [{'count': count, 'statement': shape} for count, shape in repeated[:5]]
+    })
+    return response
+
+# ============================================================================
+# METRICS (Prometheus text format)
+# ============================================================================
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+class MetricCounter:
+    kind = 'counter'
+    
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+    
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+    
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+    
+    def render(self, values):
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+class MetricGauge(MetricCounter):
+    """A per-process value (e.g. pool connections); workers' values are added up"""
+    kind = 'gauge'
+    
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+class MetricHistogram:
+    kind = 'histogram'
+    
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [per-bucket counts (last one is +Inf), sum]
+    
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+    
+    def samples(self):
+        with self._lock:
+            return {labels: [list(counts), total] for labels, (counts, total) in self._values.items()}
+    
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return [list(value[0]), value[1]]
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1]]
+    
+    def render(self, values):
+        bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {round(total, 6)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}'
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms rendered in Prometheus text format.
+
+    Without a multiprocess directory /metrics reports this process alone. With
+    one, every worker writes its samples to its own file there (at most every
+    METRICS_FLUSH_SECONDS, and on exit) and a scrape adds up all the files, so
+    it does not matter which gunicorn worker answers. Counters and histograms
+    of exited workers keep counting towards the totals; gauges only count for
+    workers that are still running.
+    """
+    
+    def __init__(self, multiprocess_dir=None, flush_seconds=5):
+        self._metrics = []
+        self._dir = multiprocess_dir
+        self._flush_seconds = flush_seconds
+        self._last_flush = 0
+        self._flush_lock = threading.Lock()
+        self.collectors = []  # callables refreshing gauges before samples are taken
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+    
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(MetricCounter(name, help_text, labelnames))
+    
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(MetricGauge(name, help_text, labelnames))
+    
+    def histogram(self, name, help_text, labelnames, buckets):
+        return self._register(MetricHistogram(name, help_text, labelnames, buckets))
+    
+    def _local_samples(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return {metric.name: metric.samples() for metric in self._metrics}
+    
+    def flush(self, force=True):
+        """Write this process's samples to the multiprocess directory"""
+        if not self._dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self._flush_seconds:
+            return
+        with self._flush_lock:
+            self._last_flush = now
+            data = {'pid': os.getpid(), 'metrics': {
+                name: [[list(labels), value] for labels, value in samples.items()]
+                for name, samples in self._local_samples().items()
+            }}
+            path = os.path.join(self._dir, f'metrics-{os.getpid()}.json')
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w') as metrics_file:
+                json.dump(data, metrics_file)
+            os.replace(temp_path, path)
+    
+    def _read_process_files(self):
+        for filename in os.listdir(self._dir):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self._dir, filename)) as metrics_file:
+                    yield json.load(metrics_file)
+            except (OSError, ValueError):
+                continue  # being replaced or half-written; the next scrape will have it
+    
+    @staticmethod
+    def _process_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+    
+    def collect(self):
+        """{metric name: {labels: value}} for this process or, in multiprocess mode, all workers"""
+        if not self._dir:
+            return self._local_samples()
+        self.flush()
+        by_name = {metric.name: metric for metric in self._metrics}
+        merged = {name: {} for name in by_name}
+        for data in self._read_process_files():
+            alive = None
+            for name, samples in data.get('metrics', {}).items():
+                metric = by_name.get(name)
+                if metric is None:
+                    continue
+                if metric.kind == 'gauge':
+                    if alive is None:
+                        alive = self._process_alive(data.get('pid', 0))
+                    if not alive:
+                        continue
+                values = merged[name]
+                for labels, value in samples:
+                    labels = tuple(labels)
+                    values[labels] = metric.merge(values.get(labels), value)
+        return merged
+    
+    def render(self, extra_lines=()):
+        samples = self.collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render(samples.get(metric.name, {})))
+        lines.extend(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry(app.config['METRICS_MULTIPROC_DIR'], app.config['METRICS_FLUSH_SECONDS'])
+atexit.register(metrics.flush)
+
+http_requests_total = metrics.counter(
+    'trimq_http_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status'])
+http_request_seconds = metrics.histogram(
+    'trimq_http_request_duration_seconds', 'Time to build each response', ['endpoint', 'method'],
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+queue_events_total = metrics.counter(
+    'trimq_queue_events_total', 'Committed queue changes (added, assigned, completed, cancelled, removed)',
+    ['branch', 'event'])
+queue_wait_seconds = metrics.histogram(
+    'trimq_queue_time_to_assign_seconds', 'Time from joining the queue to being assigned a barber', ['branch'],
+    [60, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200])
+service_duration_seconds = metrics.histogram(
+    'trimq_service_duration_seconds', 'Time from assignment to completion', ['branch'],
+    [300, 600, 900, 1200, 1800, 2700, 3600, 5400])
+cache_invalidations_total = metrics.counter(
+    'trimq_cache_invalidations_total', 'Cache evictions caused by changes committed in other processes', ['topic'])
+db_pool_connections = metrics.gauge(
+    'trimq_db_pool_connections', 'Database pool connections by state, added up over running workers', ['state'])
+
+def _collect_pool_usage():
+    with app.app_context():
+        pool = db.engine.pool
+    for state in ('size', 'checkedout', 'checkedin', 'overflow'):
+        reading = getattr(pool, state, None)
+        if reading is not None:
+            # QueuePool reports overflow as negative while below its size
+            db_pool_connections.set(max(0, reading()), state)
+
+metrics.collectors.append(_collect_pool_usage)
+
+def record_queue_metrics(event, entry):
+    """Count a committed queue change and time its wait or service"""
+    branch_code = entry.branch
+    queue_events_total.inc(branch_code, event)
+    if event == 'assigned' and entry.joined_at and entry.assigned_at:
+        queue_wait_seconds.observe(max(0, (entry.assigned_at - entry.joined_at).total_seconds()), branch_code)
+    elif event == 'completed' and entry.assigned_at and entry.completed_at:
+        service_duration_seconds.observe(max(0, (entry.completed_at - entry.assigned_at).total_seconds()), branch_code)
+
+def queue_depth_lines():
+    """Current waiting/assigned depth per branch, read from the live queue state at scrape time"""
+    lines = ['# HELP trimq_queue_depth Customers currently in the queue',
+             '# TYPE trimq_queue_depth gauge']
+    for branch_code in sorted(catalog.branches()):
+        state = queue_store.snapshot(branch_code)
+        for status, entries in (('waiting', state['waiting']), ('assigned', state['in_progress'])):
+            lines.append(f'trimq_queue_depth{_format_labels(("branch", "status"), (branch_code, status))} {len(entries)}')
+    return lines
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    http_requests_total.inc(endpoint, request.method, str(response.status_code))
+    http_request_seconds.observe(time.perf_counter() - started, endpoint, request.method)
+    metrics.flush(force=False)
+    return response
+
 # ============================================================================
 # ROUTES
 # ============================================================================
@@ -880,54 +3351,11 @@ def index():
     
     if current_user.is_master_admin():
         # Master admin dashboard with real-time franchise stats
-        branches_dict = get_branches_dict()
-        today_date = date.today()
-        
-        # Get real-time revenue for all branches
-        all_revenue_data = get_real_time_revenue_data(today_date)
-        branch_revenue = {r['branch']: r for r in all_revenue_data}
-        
-        branch_stats = {}
-        franchise_stats = {
-            'total_waiting': 0,
-            'total_in_progress': 0,
-            'total_completed_today': 0,
-            'total_barbers': 0,
-            'total_revenue': 0
-        }
-        
-        for code in branches_dict.keys():
-            waiting = Customer.query.filter_by(branch=code, status='waiting').count()
-            in_progress = Customer.query.filter_by(branch=code, status='assigned').count()
-            completed_today = Customer.query.filter(
-                Customer.branch == code,
-                Customer.status == 'completed',
-                Customer.completed_at >= datetime.now().replace(hour=0, minute=0, second=0)
-            ).count()
-            active_barbers = Barber.query.filter_by(branch=code).count()
-            
-            # Get real-time revenue
-            revenue_info = branch_revenue.get(code, {'total_revenue': 0, 'total_customers': 0})
-            
-            branch_stats[code] = {
-                'waiting': waiting,
-                'in_progress': in_progress,
-                'completed_today': completed_today,
-                'active_barbers': active_barbers,
-                'revenue': revenue_info['total_revenue'],
-                'revenue_customers': revenue_info['total_customers']
-            }
-            
-            # Add to franchise totals
-            franchise_stats['total_waiting'] += waiting
-            franchise_stats['total_in_progress'] += in_progress
-            franchise_stats['total_completed_today'] += completed_today
-            franchise_stats['total_barbers'] += active_barbers
-            franchise_stats['total_revenue'] += revenue_info['total_revenue']
+        snapshot = get_franchise_snapshot()
         
         return render_template('master_dashboard.html',
-                             franchise_stats=franchise_stats,
-                             branch_stats=branch_stats)
+                             franchise_stats=snapshot['totals'],
+                             branch_stats=snapshot['branches'])
     else:
         # Branch admin dashboard with real-time branch stats
         branch_stats = get_branch_stats(current_user.branch)
@@ -978,11 +3406,13 @@ def forgot_password():
                 expires_at=datetime.utcnow() + timedelta(hours=1)
             )
             db.session.add(reset_request)
-            db.session.commit()
             
+            # The email is queued in the same transaction and sent in the background
             if send_password_reset_email(user, token):
+                db.session.commit()
                 flash('Password reset instructions have been sent to your email.', 'success')
             else:
+                db.session.commit()
                 flash('Failed to send email. Please contact your administrator.', 'error')
         else:
             flash('If an account with that email exists, password reset instructions have been sent.', 'info')
@@ -1089,16 +3519,6 @@ def add_customer(branch_code=None):
                 customer.add_to_queue(form.service_id.data, branch_code, form.notes.data)
                 db.session.commit()
                 
-                # Create visit record
-                visit = CustomerVisit(
-                    customer_id=customer.id,
-                    service_id=form.service_id.data,
-                    branch=branch_code,
-                    notes=form.notes.data
-                )
-                db.session.add(visit)
-                db.session.commit()
-                
                 # Log the action
                 action = 'added_existing' if not is_new else 'added_new'
                 log_customer_action(customer.id, action, current_user.id, {
@@ -1112,6 +3532,7 @@ def add_customer(branch_code=None):
                 success_message = f'{customer.name} added to queue!'
                 if is_new:
                     success_message += ' (New customer created)'
+                flash_dispatched(dispatch_waiting_customers(branch_code))
                 
                 # Handle ticket printing
                 print_ticket_option = request.form.get('print_ticket')
@@ -1155,31 +3576,59 @@ def queue_manage(branch_code):
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
     
-    waiting = Customer.query.filter_by(branch=branch_code, status='waiting').order_by(Customer.created_at).all()
-    in_progress = Customer.query.filter_by(branch=branch_code, status='assigned').order_by(Customer.assigned_at).all()
-    barbers = Barber.query.filter_by(branch=branch_code).order_by(Barber.name).all()
+    def render():
+        queue = estimate_queue(branch_code)
+        branches_dict = get_branches_dict()
+        return render_template('queue.html', 
+                             waiting=queue['waiting'],
+                             in_progress=queue['in_progress'],
+                             barbers=queue['barbers'],
+                             dispatch_policies=[(name, label) for name, (label, _) in DISPATCH_POLICIES.items()],
+                             branch_code=branch_code,
+                             branch_info=branches_dict.get(branch_code, {}))
+    
+    return conditional_response(branch_etag_parts(branch_code) + [current_user.id], render)
+
+@app.route('/queue/<branch_code>/dispatch', methods=['POST'])
+@login_required
+def update_dispatch_settings(branch_code):
+    if not current_user.is_master_admin() and current_user.branch != branch_code:
+        flash('Access denied.', 'error')
+        return redirect(url_for('index'))
     
-    branches_dict = get_branches_dict()
-    return render_template('queue.html', 
-                         waiting=waiting,
-                         in_progress=in_progress,
-                         barbers=barbers,
-                         branch_code=branch_code,
-                         branch_info=branches_dict.get(branch_code, {}))
+    branch = Branch.query.filter_by(code=branch_code).first_or_404()
+    policy = request.form.get('dispatch_policy', 'fifo')
+    if policy not in DISPATCH_POLICIES:
+        flash('Unknown dispatch policy.', 'error')
+        return redirect(url_for('queue_manage', branch_code=branch_code))
+    
+    branch.auto_dispatch = request.form.get('auto_dispatch') == 'on'
+    branch.dispatch_policy = policy
+    bump_catalog_version()
+    db.session.commit()
+    
+    if branch.auto_dispatch:
+        flash(f'Auto-dispatch on: {DISPATCH_POLICIES[policy][0].lower()}.', 'success')
+        flash_dispatched(dispatch_waiting_customers(branch_code))
+    else:
+        flash('Auto-dispatch off: assign barbers by hand.', 'info')
+    return redirect(url_for('queue_manage', branch_code=branch_code))
 
 @app.route('/assign/<int:customer_id>', methods=['POST'])
 @login_required
 def assign_customer(customer_id):
     customer = Customer.query.get_or_404(customer_id)
-    barber_id = request.form.get('barber_id')
+    barber_id = request.form.get('barber_id', type=int)
     
     if barber_id:
-        customer.barber_id = barber_id
-        customer.status = 'assigned'
-        customer.assigned_at = datetime.utcnow()
-        db.session.commit()
-        barber = Barber.query.get(barber_id)
-        flash(f'{customer.name} assigned to {barber.name}', 'success')
+        # Staff may double-book a barber, but a customer is only ever seated once
+        if claim_customer(customer.id, barber_id, datetime.utcnow(), require_idle_barber=False):
+            db.session.commit()
+            barber = catalog.barber(barber_id)
+            flash(f'{customer.name} assigned to {barber["name"] if barber else "barber"}', 'success')
+        else:
+            db.session.rollback()
+            flash(f'{customer.name} is no longer waiting.', 'warning')
     
     return redirect(url_for('queue_manage', branch_code=customer.branch))
 
@@ -1187,41 +3636,125 @@ def assign_customer(customer_id):
 @login_required
 def complete_customer(customer_id):
     customer = Customer.query.get_or_404(customer_id)
+    if customer.status != 'assigned':
+        flash(f'Cannot complete {customer.name} - customer is {customer.status}.', 'error')
+        return redirect(url_for('queue_manage', branch_code=customer.branch))
+    
     customer.status = 'completed'
     customer.completed_at = datetime.utcnow()
+    
+    visit = CustomerVisit.open_for(customer)
+    if not visit:
+        # Queue entries created before visits were tracked
+        visit = CustomerVisit(
+            customer_id=customer.id,
+            service_id=customer.service_id,
+            branch=customer.branch,
+            visit_date=customer.last_visit or customer.created_at
+        )
+        db.session.add(visit)
+    visit.barber_id = customer.barber_id
+    visit.assigned_at = customer.assigned_at
+    visit.completed_at = customer.completed_at
+    visit.price_paid = customer.service.price if customer.service else 0
+    if customer.assigned_at:
+        visit.duration_minutes = round((customer.completed_at - customer.assigned_at).total_seconds() / 60, 1)
+    
+    record_completed_revenue(visit.branch, visit.service_id, visit.completed_at, visit.price_paid)
+    record_service_duration(visit.branch, visit.barber_id, visit.service_id, visit.assigned_at, visit.duration_minutes)
+    stage_queue_event(customer, 'completed')
     db.session.commit()
     flash(f'{customer.name} service completed! Revenue updated automatically.', 'success')
+    flash_dispatched(dispatch_waiting_customers(customer.branch))
     return redirect(url_for('queue_manage', branch_code=customer.branch))
 
 @app.route('/display/<branch_code>')
 def public_display(branch_code):
-    waiting = Customer.query.filter_by(branch=branch_code, status='waiting').order_by(Customer.created_at).all()
-    in_progress = Customer.query.filter_by(branch=branch_code, status='assigned').order_by(Customer.assigned_at).all()
+    def render():
+        queue = estimate_queue(branch_code)
+        branches_dict = get_branches_dict()
+        return render_template('display.html', 
+                             waiting=queue['waiting'],
+                             in_progress=queue['in_progress'],
+                             branch_code=branch_code,
+                             branch_info=branches_dict.get(branch_code, {}))
     
-    branches_dict = get_branches_dict()
-    return render_template('display.html', 
-                         waiting=waiting,
-                         in_progress=in_progress,
-                         branch_code=branch_code,
-                         branch_info=branches_dict.get(branch_code, {}))
+    return conditional_response(branch_etag_parts(branch_code), render)
+
+@app.route('/stream/<branch_code>')
+def queue_stream(branch_code):
+    """Server-Sent Events stream of live queue changes for a branch"""
+    if branch_code not in get_branches_dict():
+        return jsonify({'error': 'Unknown branch'}), 404
+    
+    # Staff with access to the branch get phone numbers and notes; public displays do not
+    include_private = current_user.is_authenticated and (
+        current_user.is_master_admin() or current_user.branch == branch_code
+    )
+    payload_key = 'private' if include_private else 'public'
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    sync_interval = app.config['SSE_SYNC_SECONDS']
+    
+    def sync_message():
+        sequence = queue_events.current_sequence(branch_code)
+        queue = estimate_queue(branch_code)
+        # Release the pooled connection; the stream can stay open for hours
+        db.session.close()
+        data = json.dumps({'event': 'sync', 'customer_id': None, 'queue': serialize_queue(queue, include_private)})
+        return sequence, format_sse('sync', data, f"{queue_events.epoch}-{sequence}")
+    
+    def generate():
+        db.session.close()
+        yield "retry: 3000\n\n"
+        
+        sequence = queue_events.resume_sequence(branch_code, last_event_id)
+        if sequence is None:
+            sequence, message = sync_message()
+            yield message
+        last_sync = time.monotonic()
+        
+        while True:
+            records = queue_events.wait_for_events(branch_code, sequence, heartbeat)
+            if not records:
+                if time.monotonic() - last_sync >= sync_interval:
+                    # Wait estimates age even when nothing happens
+                    sequence, message = sync_message()
+                    last_sync = time.monotonic()
+                    yield message
+                else:
+                    yield ": heartbeat\n\n"
+                continue
+            for record in records:
+                if record['event'] == 'resync':
+                    sequence, message = sync_message()
+                    last_sync = time.monotonic()
+                    yield message
+                    break
+                sequence = record['seq']
+                yield format_sse(record['event'], record[payload_key], record['id'])
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/ticket/<int:customer_id>')
 @login_required
 def print_ticket(customer_id):
-    customer = Customer.query.get_or_404(customer_id)
+    rows = load_queue_rows(Customer.id == customer_id)
+    if not rows:
+        abort(404)
+    customer = rows[0]
     
     if not current_user.is_master_admin() and current_user.branch != customer.branch:
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
     
-    ticket_number = generate_ticket_number(customer.id, customer.branch)
-    queue_position = Customer.query.filter(
-        Customer.branch == customer.branch,
-        Customer.status == 'waiting',
-        Customer.created_at <= customer.created_at
-    ).count()
-    
-    estimated_wait = get_wait_time(customer)
+    ticket_number = customer.ticket_number or generate_ticket_number(customer.id, customer.branch)
+    queue = estimate_queue(customer.branch)
+    queue_position = queue['positions'].get(customer.id, 0)
+    estimated_wait = queue['wait_times'].get(customer.id)
     branches_dict = get_branches_dict()
     
     return render_template('ticket.html', 
@@ -1233,75 +3766,80 @@ def print_ticket(customer_id):
 
 @app.route('/revenue-report')
 @login_required
+@read_only
 def revenue_report():
-    # Get date from query parameter, default to today
-    report_date_str = request.args.get('date')
-    if report_date_str:
-        try:
-            report_date = datetime.strptime(report_date_str, '%Y-%m-%d').date()
-        except ValueError:
-            report_date = date.today()
-    else:
-        report_date = date.today()
+    # Get the date range from query parameters (start/end, or a single date), default to today
+    try:
+        report_date, end_date = parse_report_range(request.args)
+    except ValueError:
+        report_date = end_date = business_today()
     
     # Get real-time revenue data based on user role
-    if current_user.is_master_admin():
-        revenue_data = get_real_time_revenue_data(report_date)
-        service_breakdown = get_service_breakdown(target_date=report_date)
-        branches_dict = get_branches_dict()
-    else:
-        revenue_data = get_real_time_revenue_data(report_date, current_user.branch)
-        service_breakdown = get_service_breakdown(current_user.branch, report_date)
-        branches_dict = get_branches_dict()
+    branch_code = None if current_user.is_master_admin() else current_user.branch
+    revenue_data = get_real_time_revenue_data(report_date, branch_code, end_date)
+    service_breakdown = get_service_breakdown(branch_code, report_date, end_date)
+    branches_dict = get_branches_dict()
+    daily_series = get_revenue_series(report_date, end_date, branch_code)['daily'] if end_date > report_date else []
     
     # Calculate totals
     total_revenue = sum(r['total_revenue'] for r in revenue_data)
     total_customers = sum(r['total_customers'] for r in revenue_data)
     
     # Get hourly trends
-    if current_user.is_master_admin():
-        hourly_trend = get_hourly_revenue_trend(target_date=report_date)
-    else:
-        hourly_trend = get_hourly_revenue_trend(current_user.branch, report_date)
+    hourly_trend = get_hourly_revenue_trend(branch_code, report_date, end_date)
     
     return render_template('revenue_report.html',
                          revenue_data=revenue_data,
                          service_breakdown=service_breakdown,
                          hourly_trend=hourly_trend,
                          report_date=report_date,
+                         end_date=end_date,
+                         daily_series=daily_series,
                          total_revenue=total_revenue,
                          total_customers=total_customers,
-                         today=date.today(),
+                         today=business_today(),
                          timedelta=timedelta,
                          branches_dict=branches_dict)
 
 @app.route('/api/revenue/<branch_code>')
 @login_required
+@read_only
 def api_branch_revenue(branch_code):
     """API endpoint to get real-time revenue for a branch"""
     if not current_user.is_master_admin() and current_user.branch != branch_code:
         return jsonify({'error': 'Access denied'}), 403
     
-    today = date.today()
-    revenue_data = get_branch_revenue_summary(branch_code, today)
+    try:
+        start_date, end_date = parse_report_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'branch': branch_code,
-        'date': today.isoformat(),
-        'total_revenue': revenue_data['total_revenue'],
-        'total_customers': revenue_data['total_customers'],
-        'last_updated': revenue_data['updated_at'].isoformat()
-    })
+    def build():
+        revenue_data = get_branch_revenue_summary(branch_code, start_date, end_date)
+        return jsonify({
+            'branch': branch_code,
+            'date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'total_revenue': revenue_data['total_revenue'],
+            'total_customers': revenue_data['total_customers'],
+            'last_updated': revenue_data['updated_at'].isoformat()
+        })
+    
+    return conditional_response(revenue_etag_parts(branch_code, start_date, end_date), build)
 
 @app.route('/api/revenue/all')
 @login_required
+@read_only
 def api_all_revenue():
     """API endpoint to get real-time revenue for all branches (Master Admin only)"""
     if not current_user.is_master_admin():
         return jsonify({'error': 'Access denied'}), 403
     
-    today = date.today()
-    revenue_data = get_real_time_revenue_data(today)
+    try:
+        today, end_date = parse_report_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    revenue_data = get_real_time_revenue_data(today, end_date=end_date)
     
     # Include branches with zero revenue
     all_branches = get_branches_dict()
@@ -1329,50 +3867,150 @@ def api_all_revenue():
             'total_revenue': total_revenue,
             'total_customers': total_customers,
             'date': today.isoformat(),
+            'end_date': end_date.isoformat(),
             'last_updated': datetime.utcnow().isoformat()
         }
     })
 
+@app.route('/api/revenue/series')
+@login_required
+@read_only
+def api_revenue_series():
+    """API endpoint for per-day, per-branch and per-service revenue over a date range"""
+    branch_code = request.args.get('branch') or None
+    if not current_user.is_master_admin():
+        if branch_code and branch_code != current_user.branch:
+            return jsonify({'error': 'Access denied'}), 403
+        branch_code = current_user.branch
+    
+    try:
+        start_date, end_date = parse_report_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    series = get_revenue_series(start_date, end_date, branch_code)
+    
+    return jsonify({
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'branch': branch_code or 'all',
+        'daily': [
+            {'date': day['date'].isoformat(), 'revenue': day['revenue'], 'customers': day['customers']}
+            for day in series['daily']
+        ],
+        'branches': series['branches'],
+        'services': series['services'],
+        'totals': series['totals']
+    })
+
+@app.route('/api/franchise/snapshot')
+@login_required
+@read_only
+def api_franchise_snapshot():
+    """API endpoint for the master dashboard's franchise overview (Master Admin only)"""
+    if not current_user.is_master_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    snapshot = get_franchise_snapshot()
+    
+    return jsonify({
+        'branches': snapshot['branches'],
+        'totals': snapshot['totals'],
+        'date': snapshot['date'].isoformat(),
+        'last_updated': snapshot['updated_at'].isoformat()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Queue, request and database pool telemetry in Prometheus text format"""
+    token = app.config['METRICS_TOKEN']
+    if token:
+        if not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        # Queue depth per branch and the endpoint list are not for the public
+        return Response('Forbidden: set METRICS_TOKEN to scrape from another host\n', status=403, mimetype='text/plain')
+    
+    body = metrics.render(queue_depth_lines())
+    db.session.close()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/requests')
+@login_required
+def debug_requests():
+    """Recent requests with query counts, DB time and repeated statements (Master Admin only)"""
+    if not current_user.is_master_admin():
+        return jsonify({'error': 'Access denied'}), 403
+
+    records = request_log.recent()
+    if request.args.get('n_plus_one') in ('1', 'true'):
+        records = [record for record in records if record['n_plus_one']]
+    if request.args.get('endpoint'):
+        records = [record for record in records if record['endpoint'] == request.args['endpoint']]
+
+    return jsonify({
+        'instrumentation': app.config['SQL_INSTRUMENTATION'],
+        'n_plus_one_threshold': app.config['SQL_N_PLUS_ONE_THRESHOLD'],
+        'requests': records[:request.args.get('limit', 50, type=int)]
+    })
+
 @app.route('/api/service-breakdown/<branch_code>')
 @login_required
+@read_only
 def api_service_breakdown(branch_code):
     """API endpoint for service breakdown"""
     if not current_user.is_master_admin() and current_user.branch != branch_code:
         return jsonify({'error': 'Access denied'}), 403
     
-    today = date.today()
-    breakdown = get_service_breakdown(branch_code if branch_code != 'all' else None, today)
+    try:
+        start_date, end_date = parse_report_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    branch_filter = branch_code if branch_code != 'all' else None
     
-    result = []
-    for service in breakdown:
-        result.append({
-            'service_name': service.name,
-            'price': float(service.price),
-            'count': int(service.service_count),
-            'revenue': float(service.service_revenue)
-        })
+    def build():
+        breakdown = get_service_breakdown(branch_filter, start_date, end_date)
+        
+        result = []
+        for service in breakdown:
+            result.append({
+                'service_name': service.name,
+                'price': float(service.price),
+                'count': int(service.service_count),
+                'revenue': float(service.service_revenue)
+            })
+        
+        return jsonify({'services': result})
     
-    return jsonify({'services': result})
+    return conditional_response(['services'] + revenue_etag_parts(branch_filter, start_date, end_date), build)
 
 @app.route('/api/hourly-trend/<branch_code>')
 @login_required
+@read_only
 def api_hourly_trend(branch_code):
     """API endpoint for hourly revenue trend"""
     if not current_user.is_master_admin() and current_user.branch != branch_code:
         return jsonify({'error': 'Access denied'}), 403
     
-    today = date.today()
-    trend = get_hourly_revenue_trend(branch_code if branch_code != 'all' else None, today)
+    try:
+        start_date, end_date = parse_report_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    branch_filter = branch_code if branch_code != 'all' else None
     
-    result = []
-    for hour_data in trend:
-        result.append({
-            'hour': int(hour_data.hour),
-            'revenue': float(hour_data.hour_revenue or 0),
-            'customers': int(hour_data.hour_customers or 0)
-        })
+    def build():
+        trend = get_hourly_revenue_trend(branch_filter, start_date, end_date)
+        
+        result = []
+        for hour_data in trend:
+            result.append({
+                'hour': int(hour_data.hour),
+                'revenue': float(hour_data.hour_revenue or 0),
+                'customers': int(hour_data.hour_customers or 0)
+            })
+        
+        return jsonify({'hourly_data': result})
     
-    return jsonify({'hourly_data': result})
+    return conditional_response(['hourly'] + revenue_etag_parts(branch_filter, start_date, end_date), build)
 
 @app.route('/settings')
 @login_required
@@ -1562,6 +4200,7 @@ def add_service():
     if name and duration and price:
         service = Service(name=name, duration=int(duration), price=float(price))
         db.session.add(service)
+        bump_catalog_version()
         db.session.commit()
         flash(f'Service "{name}" added!', 'success')
     
@@ -1583,7 +4222,9 @@ def edit_service(service_id):
         service.name = name
         service.duration = int(duration)
         service.price = float(price)
+        bump_catalog_version()
         db.session.commit()
+        queue_store.invalidate()
         flash(f'Service "{name}" updated!', 'success')
     
     return redirect(url_for('settings'))
@@ -1607,6 +4248,7 @@ def delete_service(service_id):
     
     name = service.name
     db.session.delete(service)
+    bump_catalog_version()
     db.session.commit()
     flash(f'Service "{name}" deleted successfully!', 'success')
     return redirect(url_for('settings'))
@@ -1620,7 +4262,9 @@ def add_barber():
     if name and branch:
         barber = Barber(name=name, branch=branch)
         db.session.add(barber)
+        bump_catalog_version()
         db.session.commit()
+        queue_store.invalidate(branch)
         flash(f'Barber "{name}" added!', 'success')
     
     return redirect(url_for('settings'))
@@ -1640,8 +4284,11 @@ def delete_barber(barber_id):
         return redirect(url_for('settings'))
     
     name = barber.name
+    branch = barber.branch
     db.session.delete(barber)
+    bump_catalog_version()
     db.session.commit()
+    queue_store.invalidate(branch)
     flash(f'Barber "{name}" deleted successfully!', 'success')
     return redirect(url_for('settings'))
 
@@ -1661,6 +4308,7 @@ def add_branch():
         if not Branch.query.filter_by(code=code).first():
             branch = Branch(code=code, name=name, address=address, phone=phone)
             db.session.add(branch)
+            bump_catalog_version()
             db.session.commit()
             flash(f'Branch "{name}" added!', 'success')
         else:
@@ -1684,6 +4332,7 @@ def edit_branch(branch_id):
         branch.name = name
         branch.address = address
         branch.phone = phone or ''
+        bump_catalog_version()
         db.session.commit()
         flash(f'Branch "{name}" updated!', 'success')
     
@@ -1709,8 +4358,7 @@ def remove_customer(customer_id):
     customer_name = customer.name
     customer_branch = customer.branch
     
-    # Delete the customer record
-    db.session.delete(customer)
+    take_off_queue(customer)
     db.session.commit()
     
     flash(f'{customer_name} has been removed from the queue.', 'success')
@@ -1733,12 +4381,21 @@ def cancel_customer(customer_id):
         return redirect(url_for('queue_manage', branch_code=customer.branch))
     
     # Reset customer back to waiting status
+    freed_barber_id = customer.barber_id
     customer.status = 'waiting'
     customer.barber_id = None
     customer.assigned_at = None
+    
+    visit = CustomerVisit.open_for(customer)
+    if visit:
+        visit.barber_id = None
+        visit.assigned_at = None
+    
+    stage_queue_event(customer, 'cancelled')
     db.session.commit()
     
     flash(f'{customer.name} has been moved back to waiting queue.', 'info')
+    flash_dispatched(dispatch_waiting_customers(customer.branch, skip=(customer.id, freed_barber_id)))
     return redirect(url_for('queue_manage', branch_code=customer.branch))
 
 @app.route('/api/remove_customer/<int:customer_id>', methods=['DELETE'])
@@ -1760,13 +4417,12 @@ def api_remove_customer(customer_id):
             }), 400
         
         customer_name = customer.name
+        freed_barber_id = customer.barber_id
         
-        # Also delete associated visit records to avoid foreign key constraints
-        CustomerVisit.query.filter_by(customer_id=customer.id).delete()
-        
-        # Delete the customer record
-        db.session.delete(customer)
+        take_off_queue(customer)
         db.session.commit()
+        if freed_barber_id:
+            dispatch_waiting_customers(customer.branch)
         
         return jsonify({
             'success': True, 
@@ -1793,11 +4449,8 @@ def check_duplicate_customer(branch_code):
     if not current_user.is_master_admin() and current_user.branch != branch_code:
         return jsonify({'error': 'Access denied'}), 403
     
-    existing_customer = Customer.query.filter_by(
-        phone=phone,
-        branch=branch_code,
-        status='waiting'
-    ).first()
+    queue = estimate_queue(branch_code)
+    existing_customer = next((row for row in queue['waiting'] if row.phone == phone), None)
     
     if existing_customer:
         return jsonify({
@@ -1806,9 +4459,9 @@ def check_duplicate_customer(branch_code):
                 'id': existing_customer.id,
                 'name': existing_customer.name,
                 'phone': existing_customer.phone,
-                'service': existing_customer.service.name,
+                'service': existing_customer.service_name,
                 'created_at': existing_customer.created_at.strftime('%H:%M'),
-                'wait_time': get_wait_time(existing_customer)
+                'wait_time': existing_customer.wait_time
             }
         })
     
@@ -1828,8 +4481,8 @@ def re_add_customer(branch_code):
     service_name = request.args.get('service', '')
     
     # Try to find the service by name
-    service = Service.query.filter_by(name=service_name).first()
-    service_id = service.id if service else None
+    service = catalog.service_by_name(service_name)
+    service_id = service['id'] if service else None
     
     return render_template('add_customer.html',
                          form=CustomerForm(name=name, phone=phone, service_id=service_id),
@@ -1840,6 +4493,7 @@ def re_add_customer(branch_code):
 
 @app.route('/customers')
 @login_required
+@read_only
 def manage_customers():
     """Customer database management page"""
     search = request.args.get('search', '').strip()
@@ -1860,16 +4514,9 @@ def manage_customers():
         # Branch admins can only see customers who have visited their branch
         query = Customer.query.filter(Customer.branch == current_user.branch)
     
-    # Apply search filter
+    # Apply search filter (ranked best match first when the index can answer it)
     if search:
-        search_filter = f"%{search}%"
-        query = query.filter(
-            db.or_(
-                Customer.name.ilike(search_filter),
-                Customer.phone.ilike(search_filter),
-                Customer.email.ilike(search_filter)
-            )
-        )
+        query = search_customers(query, search)
     
     # Order by most recent activity
     query = query.order_by(
@@ -1934,11 +4581,11 @@ def api_add_customer():
         
         # Handle photo upload
         if photo_file and photo_file.filename:
-            filename = save_customer_photo(photo_file, customer.id)
-            if filename:
-                customer.photo_filename = filename
+            stage_customer_photo(photo_file, customer)
         
+        mark_branch_changed(customer.branch)
         db.session.commit()
+        queue_store.invalidate(customer.branch)
         
         return jsonify({
             'success': True, 
@@ -1968,9 +4615,23 @@ def api_get_customer(customer_id):
                 'address': customer.address,
                 'notes': customer.notes,
                 'photo_filename': customer.photo_filename,
+                'photo_status': customer.photo_status,
+                'photo_url': customer.get_photo_url('md'),
                 'total_visits': customer.total_visits,
                 'last_visit': customer.last_visit.isoformat() if customer.last_visit else None,
-                'created_at': customer.created_at.isoformat()
+                'created_at': customer.created_at.isoformat(),
+                'recent_visits': [
+                    {
+                        'visit_date': visit.visit_date.isoformat() if visit.visit_date else None,
+                        'branch': visit.branch,
+                        'service_id': visit.service_id,
+                        'barber_id': visit.barber_id,
+                        'completed_at': visit.completed_at.isoformat() if visit.completed_at else None,
+                        'price_paid': visit.price_paid,
+                        'duration_minutes': visit.duration_minutes
+                    }
+                    for visit in get_customer_visit_history(customer.id)
+                ]
             }
         })
         
@@ -2015,16 +4676,14 @@ def api_update_customer(customer_id):
         # Handle photo upload
         photo_file = request.files.get('photo')
         if photo_file and photo_file.filename:
-            # Delete old photo
-            if customer.photo_filename:
-                delete_customer_photo(customer.photo_filename)
-            
-            # Save new photo
-            filename = save_customer_photo(photo_file, customer.id)
-            if filename:
-                customer.photo_filename = filename
+            # The old photo is replaced once the new one is processed
+            stage_customer_photo(photo_file, customer)
         
+        if customer.status in ['waiting', 'assigned']:
+            mark_branch_changed(customer.branch)
         db.session.commit()
+        if customer.status in ['waiting', 'assigned']:
+            queue_store.invalidate(customer.branch)
         
         return jsonify({
             'success': True, 
@@ -2050,6 +4709,7 @@ def api_delete_customer(customer_id):
             }), 400
         
         customer_name = customer.name
+        customer_branch = customer.branch
         
         # Delete photo file if exists
         if customer.photo_filename:
@@ -2057,7 +4717,9 @@ def api_delete_customer(customer_id):
         
         # Delete customer record
         db.session.delete(customer)
+        mark_branch_changed(customer_branch)
         db.session.commit()
+        queue_store.invalidate(customer_branch)
         
         return jsonify({
             'success': True,
@@ -2068,6 +4730,38 @@ def api_delete_customer(customer_id):
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/customers/import', methods=['POST'])
+@login_required
+def api_import_customers():
+    """API endpoint to bulk import customers from a CSV export"""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'message': 'Please choose a CSV file to import'}), 400
+    
+    branch_code = current_user.branch
+    if current_user.is_master_admin() and request.form.get('branch'):
+        branch_code = request.form.get('branch')
+    if branch_code not in get_branches_dict():
+        return jsonify({'success': False, 'message': 'Invalid branch selected'}), 400
+    
+    try:
+        # utf-8-sig strips the byte order mark Excel puts on CSV exports
+        text_stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        summary = import_customers(text_stream, branch_code)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Could not read CSV: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+    
+    log_customer_action(None, 'bulk_import', current_user.id, {k: v for k, v in summary.items() if k != 'rejected_rows'})
+    return jsonify({
+        'success': True,
+        'message': f"Imported {summary['imported']} of {summary['rows']} customers",
+        **summary
+    })
+
 @app.route('/api/customers/search')
 @login_required
 def api_search_customers():
@@ -2079,12 +4773,8 @@ def api_search_customers():
         if not query or len(query) < 2:
             return jsonify({'customers': []})
         
-        search_filter = f"%{query}%"
-        customers = Customer.query.filter(
-            db.or_(
-                Customer.name.ilike(search_filter),
-                Customer.phone.ilike(search_filter)
-            )
+        customers = search_customers(Customer.query, query, limit=limit).order_by(
+            Customer.last_visit.desc().nullslast()
         ).limit(limit).all()
         
         results = []
@@ -2103,72 +4793,290 @@ def api_search_customers():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 # ============================================================================
-# UTILITY FUNCTIONS FOR MAINTENANCE
+# SCHEMA MIGRATIONS
 # ============================================================================
 
-def migrate_database():
-    """Handle database schema migrations"""
+# Ordered registry of (version, description, step). Each step runs exactly once
+# per database, in its own transaction, and the version is recorded in the same
+# transaction. Steps must cope with both a fresh database (where step 1 has
+# just created every table from the current models) and an older one.
+MIGRATIONS = []
+
+def migration(version, description):
+    """Register a schema migration step"""
+    def register(step):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append((version, description, step))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return step
+    return register
+
+def _column_names(conn, table_name):
+    return [column['name'] for column in sa_inspect(conn).get_columns(table_name)]
+
+def _as_datetime(value):
+    """Raw SQL hands back SQLite datetimes as text"""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def _add_missing_columns(conn, table_name, columns):
+    """Add (name, ddl) columns that an older database is missing"""
+    existing = _column_names(conn, table_name)
+    quoted_table = conn.dialect.identifier_preparer.quote(table_name)  # "user" is reserved in PostgreSQL
+    for name, ddl in columns:
+        if name not in existing:
+            if conn.dialect.name == 'postgresql':
+                ddl = ddl.replace('DATETIME', 'TIMESTAMP')
+            conn.execute(db.text(f"ALTER TABLE {quoted_table} ADD COLUMN {name} {ddl}"))
+            print(f"✅ Added {table_name}.{name}")
+
+@migration(1, "Create tables missing from older databases")
+def _create_base_tables(conn):
+    db.metadata.create_all(conn)
+
+@migration(2, "Add email to users")
+def _add_user_email(conn):
+    _add_missing_columns(conn, 'user', [('email', 'VARCHAR(120) UNIQUE')])
+
+@migration(3, "Add customer profile columns")
+def _add_customer_profile_columns(conn):
+    existing = _column_names(conn, 'customer')
+    _add_missing_columns(conn, 'customer', [
+        ('email', 'VARCHAR(120)'),
+        ('address', 'TEXT'),
+        ('photo_filename', 'VARCHAR(255)'),
+        ('last_visit', 'DATETIME'),
+        ('total_visits', 'INTEGER DEFAULT 0')
+    ])
+    if 'total_visits' not in existing:
+        conn.execute(db.text("""
+            UPDATE customer 
+            SET total_visits = 1, last_visit = created_at 
+            WHERE total_visits IS NULL OR total_visits = 0
+        """))
+
+@migration(4, "Assign customers without a branch to the main branch")
+def _assign_missing_customer_branches(conn):
+    result = conn.execute(db.text("UPDATE customer SET branch = 'main' WHERE branch IS NULL OR branch = ''"))
+    if result.rowcount:
+        print(f"Updated {result.rowcount} customer records without branch information")
+
+@migration(5, "Add visit lifecycle columns and indexes")
+def _add_visit_lifecycle(conn):
+    _add_missing_columns(conn, 'customer_visit', [
+        ('assigned_at', 'DATETIME'),
+        ('duration_minutes', 'FLOAT')
+    ])
+    conn.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_customer_visit_branch_completed ON customer_visit (branch, completed_at)"
+    ))
+    conn.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_customer_visit_customer_date ON customer_visit (customer_id, visit_date)"
+    ))
+    
+    # Completed customers whose visit was never stamped: copy the completion
+    # onto their latest visit, or record one. Plain SQL keeps this step valid
+    # after later migrations add columns to the models.
+    completed = conn.execute(db.text("""
+        SELECT c.id, c.service_id, c.branch, c.barber_id, c.assigned_at, c.completed_at,
+               c.last_visit, c.created_at, s.price
+        FROM customer c LEFT JOIN service s ON s.id = c.service_id
+        WHERE c.status = 'completed' AND c.completed_at IS NOT NULL
+    """)).fetchall()
+    stamped = 0
+    for customer in completed:
+        visit = conn.execute(db.text("""
+            SELECT id, completed_at FROM customer_visit
+            WHERE customer_id = :customer_id ORDER BY visit_date DESC LIMIT 1
+        """), {'customer_id': customer.id}).first()
+        if visit and visit.completed_at:
+            continue
+        stamped += 1
+        
+        duration_minutes = None
+        if customer.assigned_at:
+            elapsed = _as_datetime(customer.completed_at) - _as_datetime(customer.assigned_at)
+            duration_minutes = round(elapsed.total_seconds() / 60, 1)
+        params = {
+            'customer_id': customer.id,
+            'service_id': customer.service_id,
+            'branch': customer.branch or 'main',
+            'visit_date': customer.last_visit or customer.created_at,
+            'barber_id': customer.barber_id,
+            'assigned_at': customer.assigned_at,
+            'completed_at': customer.completed_at,
+            'price_paid': customer.price or 0,
+            'duration_minutes': duration_minutes
+        }
+        if visit:
+            params['id'] = visit.id
+            conn.execute(db.text("""
+                UPDATE customer_visit
+                SET barber_id = :barber_id, assigned_at = :assigned_at, completed_at = :completed_at,
+                    price_paid = :price_paid, duration_minutes = :duration_minutes
+                WHERE id = :id
+            """), params)
+        else:
+            conn.execute(db.text("""
+                INSERT INTO customer_visit (customer_id, service_id, branch, visit_date, barber_id,
+                                            assigned_at, completed_at, price_paid, duration_minutes)
+                VALUES (:customer_id, :service_id, :branch, :visit_date, :barber_id,
+                        :assigned_at, :completed_at, :price_paid, :duration_minutes)
+            """), params)
+    if stamped:
+        print(f"✅ Stamped {stamped} completed visits")
+
+@migration(6, "Backfill the revenue rollup from completed visits")
+def _backfill_revenue_rollup(conn):
+    session = OrmSession(bind=conn)
+    first_completed = session.query(func.min(CustomerVisit.completed_at)).scalar()
+    if first_completed:
+        rows = rebuild_revenue_rollup(first_completed.date(), business_today(), session=session)
+        print(f"✅ Revenue rollup backfilled ({rows} rows)")
+    session.close()
+
+@migration(7, "Add the customer full-text search index")
+def _add_customer_search_index(conn):
+    if conn.dialect.name == 'postgresql':
+        # PostgreSQL answers the ILIKE search from trigram indexes instead
+        try:
+            with conn.begin_nested():
+                conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for column in ('name', 'phone', 'email'):
+                    conn.execute(db.text(
+                        f"CREATE INDEX IF NOT EXISTS ix_customer_{column}_trgm ON customer USING gin ({column} gin_trgm_ops)"
+                    ))
+        except SQLAlchemyError as e:
+            print(f"Customer search index skipped: {e}")
+        return
+    if conn.dialect.name != 'sqlite':
+        print("Customer search index skipped: full-text search needs SQLite FTS5")
+        return
+    
+    # External-content FTS5 table over customer, kept in sync by triggers.
+    # The trigram tokenizer matches any substring of 3+ characters, which
+    # covers partial phone numbers as well as names.
     try:
-        with db.engine.connect() as conn:
-            result = conn.execute(db.text("PRAGMA table_info(user)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            if 'email' not in columns:
-                print("Adding email column to user table...")
-                conn.execute(db.text("ALTER TABLE user ADD COLUMN email VARCHAR(120) UNIQUE"))
-                conn.commit()
-                print("✅ Email column added successfully!")
-            
-            result = conn.execute(db.text("SELECT name FROM sqlite_master WHERE type='table' AND name='password_reset'"))
-            if not result.fetchone():
-                print("Creating password_reset table...")
-                PasswordReset.__table__.create(db.engine, checkfirst=True)
-                print("✅ Password reset table created successfully!")
-                
-    except Exception as e:
-        print(f"Migration error: {e}")
-        print("⚠️  You may need to delete the database file and restart")
+        with conn.begin_nested():
+            conn.execute(db.text("""
+                CREATE VIRTUAL TABLE customer_fts USING fts5(
+                    name, phone, email, notes,
+                    content='customer', content_rowid='id', tokenize='trigram'
+                )
+            """))
+    except OperationalError as e:
+        print(f"Customer search index skipped: {e}")
+        return
+    
+    conn.execute(db.text("""
+        CREATE TRIGGER customer_fts_insert AFTER INSERT ON customer BEGIN
+            INSERT INTO customer_fts(rowid, name, phone, email, notes)
+            VALUES (new.id, new.name, new.phone, new.email, new.notes);
+        END
+    """))
+    conn.execute(db.text("""
+        CREATE TRIGGER customer_fts_delete AFTER DELETE ON customer BEGIN
+            INSERT INTO customer_fts(customer_fts, rowid, name, phone, email, notes)
+            VALUES ('delete', old.id, old.name, old.phone, old.email, old.notes);
+        END
+    """))
+    conn.execute(db.text("""
+        CREATE TRIGGER customer_fts_update AFTER UPDATE OF name, phone, email, notes ON customer BEGIN
+            INSERT INTO customer_fts(customer_fts, rowid, name, phone, email, notes)
+            VALUES ('delete', old.id, old.name, old.phone, old.email, old.notes);
+            INSERT INTO customer_fts(rowid, name, phone, email, notes)
+            VALUES (new.id, new.name, new.phone, new.email, new.notes);
+        END
+    """))
+    # Rank name and phone hits above email and notes
+    conn.execute(db.text("INSERT INTO customer_fts(customer_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0)')"))
+    conn.execute(db.text("INSERT INTO customer_fts(customer_fts) VALUES ('rebuild')"))
+
+@migration(8, "Add the catalog version counter")
+def _add_catalog_version(conn):
+    CatalogVersion.__table__.create(conn, checkfirst=True)
+    if not conn.execute(db.text("SELECT 1 FROM catalog_version WHERE id = 1")).first():
+        conn.execute(CatalogVersion.__table__.insert().values(id=1, version=0, updated_at=datetime.utcnow()))
+
+@migration(9, "Add customer photo processing status")
+def _add_photo_status(conn):
+    _add_missing_columns(conn, 'customer', [('photo_status', 'VARCHAR(20)')])
+
+@migration(10, "Add the email outbox")
+def _add_email_outbox(conn):
+    EmailOutbox.__table__.create(conn, checkfirst=True)
+
+@migration(11, "Add per-branch state versions")
+def _add_branch_state_version(conn):
+    BranchStateVersion.__table__.create(conn, checkfirst=True)
+
+@migration(12, "Add learned service duration statistics")
+def _add_duration_stats(conn):
+    DurationStat.__table__.create(conn, checkfirst=True)
+    session = OrmSession(bind=conn)
+    rows = rebuild_duration_stats(session=session)
+    if rows:
+        print(f"✅ Duration statistics backfilled ({rows} rows)")
+    session.close()
 
-def migrate_customer_database():
-    """Migrate existing customer data to new schema"""
+@migration(13, "Add branch auto-dispatch settings")
+def _add_branch_dispatch_settings(conn):
+    _add_missing_columns(conn, 'branch', [
+        ('auto_dispatch', 'BOOLEAN DEFAULT FALSE'),
+        ('dispatch_policy', "VARCHAR(30) DEFAULT 'fifo'")
+    ])
+
+@migration(14, "Add daily per-branch ticket numbers")
+def _add_ticket_sequence(conn):
+    TicketSequence.__table__.create(conn, checkfirst=True)
+    _add_missing_columns(conn, 'customer', [('ticket_number', 'VARCHAR(30)')])
+
+@migration(15, "Add the cache invalidation change log")
+def _add_cache_invalidation(conn):
+    CacheInvalidation.__table__.create(conn, checkfirst=True)
+
+def latest_schema_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def current_schema_version():
+    """Get the database's schema version, or None when it has never been versioned"""
     try:
         with db.engine.connect() as conn:
-            # Check if columns exist and add them if missing
-            result = conn.execute(db.text("PRAGMA table_info(customer)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            migrations = []
-            if 'email' not in columns:
-                migrations.append("ALTER TABLE customer ADD COLUMN email VARCHAR(120)")
-            if 'address' not in columns:
-                migrations.append("ALTER TABLE customer ADD COLUMN address TEXT")
-            if 'photo_filename' not in columns:
-                migrations.append("ALTER TABLE customer ADD COLUMN photo_filename VARCHAR(255)")
-            if 'last_visit' not in columns:
-                migrations.append("ALTER TABLE customer ADD COLUMN last_visit DATETIME")
-            if 'total_visits' not in columns:
-                migrations.append("ALTER TABLE customer ADD COLUMN total_visits INTEGER DEFAULT 0")
-            
-            for migration in migrations:
-                try:
-                    conn.execute(db.text(migration))
-                    conn.commit()
-                    print(f"✅ Executed: {migration}")
-                except Exception as e:
-                    print(f"⚠️  Migration failed: {migration} - {e}")
-            
-            # Update existing customers
-            if migrations:
-                conn.execute(db.text("""
-                    UPDATE customer 
-                    SET total_visits = 1, last_visit = created_at 
-                    WHERE total_visits IS NULL OR total_visits = 0
-                """))
-                conn.commit()
-                print("✅ Updated existing customer visit counts")
-                
-    except Exception as e:
-        print(f"Migration error: {e}")
+            return conn.execute(db.text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except SQLAlchemyError:
+        return None
+
+def run_migrations():
+    """Apply every registered migration the database has not seen yet"""
+    SchemaVersion.__table__.create(db.engine, checkfirst=True)
+    with db.engine.connect() as conn:
+        applied = {row[0] for row in conn.execute(db.text("SELECT version FROM schema_version"))}
+    
+    count = 0
+    for version, description, step in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with db.engine.begin() as conn:
+                step(conn)
+                conn.execute(SchemaVersion.__table__.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another worker applied this version first
+            continue
+        print(f"✅ Migration {version}: {description}")
+        count += 1
+    return count
+
+def ensure_schema():
+    """Bring the database up to date; costs a single version check when it already is"""
+    version = current_schema_version()
+    if version is not None and version >= latest_schema_version():
+        return 0
+    return run_migrations()
 
 def cleanup_expired_resets():
     """Remove expired password reset tokens"""
@@ -2182,27 +5090,91 @@ def cleanup_expired_resets():
     db.session.commit()
     return len(expired)
 
-def update_existing_customers_branch():
-    """Update existing customers without branch information"""
-    try:
-        customers_without_branch = Customer.query.filter(
-            db.or_(Customer.branch.is_(None), Customer.branch == '')
-        ).all()
-        
-        if customers_without_branch:
-            print(f"Found {len(customers_without_branch)} customers without branch information")
-            
-            # For now, assign them to 'main' branch, but you could implement logic
-            # to assign based on their service history or ask admin to assign manually
-            for customer in customers_without_branch:
-                customer.branch = 'main'  # or prompt for branch assignment
-            
-            db.session.commit()
-            print(f"Updated {len(customers_without_branch)} customer records")
-        
-    except Exception as e:
-        print(f"Error updating customer branches: {e}")
-        db.session.rollback()
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations"""
+    count = run_migrations()
+    print(f"✅ Schema at version {current_schema_version()} ({count} migration(s) applied)")
+
+@app.cli.command('seed')
+def seed_command():
+    """Create the sample branches, services, barbers and user accounts"""
+    create_sample_data()
+
+@app.cli.command('cleanup-resets')
+def cleanup_resets_command():
+    """Remove expired password reset tokens"""
+    expired_count = cleanup_expired_resets()
+    print(f"Cleaned up {expired_count} expired password reset tokens")
+
+@app.cli.command('process-staged-photos')
+def process_staged_photos_command():
+    """Process uploads left in the staging area (e.g. by a worker that was restarted)"""
+    staging = app.config['PHOTO_STAGING_FOLDER']
+    processed = 0
+    for staged_name in sorted(os.listdir(staging)):
+        parts = staged_name.split('_')
+        if len(parts) < 3 or parts[0] != 'customer' or not parts[1].isdigit():
+            continue
+        if process_staged_photo(int(parts[1]), os.path.join(staging, staged_name)):
+            processed += 1
+    print(f"✅ Processed {processed} staged photo(s)")
+
+@app.cli.command('send-outbox')
+def send_outbox_command():
+    """Send every due email in the outbox now"""
+    attempted = email_sender.drain()
+    failed = EmailOutbox.query.filter_by(status='failed').count()
+    print(f"✅ Attempted {attempted} email(s); {failed} message(s) have permanently failed")
+
+@app.cli.command('import-customers')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--branch', 'branch_code', default='main', show_default=True, help='Branch the customers belong to.')
+@click.option('--chunk-size', default=CUSTOMER_IMPORT_CHUNK_SIZE, show_default=True, help='Rows per transaction.')
+def import_customers_command(csv_path, branch_code, chunk_size):
+    """Bulk import customers from a CSV file (name, phone, email, address, notes)"""
+    if branch_code not in get_branches_dict():
+        raise click.BadParameter(f'Unknown branch {branch_code}', param_hint='--branch')
+    
+    started = time.monotonic()
+    
+    def progress(summary):
+        print(f"  {summary['rows']} rows read, {summary['imported']} imported, {summary['rejected']} rejected")
+    
+    with open(csv_path, encoding='utf-8-sig', newline='') as csv_file:
+        summary = import_customers(csv_file, branch_code, chunk_size=chunk_size, progress=progress)
+    
+    for rejected in summary['rejected_rows']:
+        print(f"  line {rejected['line']}: {rejected['reason']}")
+    skipped = summary['rejected'] + summary['duplicates']
+    if skipped > len(summary['rejected_rows']):
+        print(f"  ... and {skipped - len(summary['rejected_rows'])} more skipped rows")
+    print(f"✅ Imported {summary['imported']} of {summary['rows']} customers in {time.monotonic() - started:.1f}s "
+          f"({summary['duplicates']} duplicates, {summary['rejected']} rejected)")
+
+@app.cli.command('rebuild-revenue-rollup')
+@click.option('--start', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First day to rebuild (YYYY-MM-DD). Defaults to today.')
+@click.option('--end', 'end_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Last day to rebuild (YYYY-MM-DD). Defaults to the start day.')
+def rebuild_revenue_rollup_command(start_date, end_date):
+    """Recompute the revenue rollup for a date range from raw data"""
+    start_day = start_date.date() if start_date else business_today()
+    end_day = end_date.date() if end_date else start_day
+    if end_day < start_day:
+        raise click.BadParameter('--end must not be before --start')
+    
+    rows = rebuild_revenue_rollup(start_day, end_day)
+    broadcast_invalidation('revenue')
+    print(f"✅ Rebuilt revenue rollup for {start_day} to {end_day} ({rows} rows)")
+
+@app.cli.command('rebuild-duration-stats')
+def rebuild_duration_stats_command():
+    """Recompute learned service times from completed visits"""
+    rows = rebuild_duration_stats()
+    queue_store.invalidate()
+    broadcast_invalidation('queue')
+    print(f"✅ Rebuilt duration statistics ({rows} barber/service/hour-band rows)")
 
 # ============================================================================
 # INITIALIZATION
@@ -2275,26 +5247,173 @@ def create_sample_data():
             continue
     
     try:
+        bump_catalog_version()
         db.session.commit()
         print("✅ Sample data created/updated successfully!")
     except Exception as e:
         print(f"Error saving sample data: {e}")
         db.session.rollback()
 
-if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        migrate_database()
-        migrate_customer_database()  # New customer migration function
+# Relative arrivals per opening hour (8:00-19:00): a lunchtime bump and an after-work peak
+ARRIVAL_CURVE = {8: 3, 9: 5, 10: 6, 11: 7, 12: 9, 13: 8, 14: 6, 15: 6, 16: 8, 17: 11, 18: 10, 19: 5}
+# Monday=0 ... Sunday=6; Saturday is the busiest day, Sunday the quietest
+WEEKDAY_FACTOR = {0: 0.8, 1: 0.85, 2: 0.9, 3: 0.95, 4: 1.2, 5: 1.6, 6: 0.7}
+FIRST_NAMES = ['Kwame', 'Kofi', 'Yaw', 'Kwabena', 'Kwaku', 'Kojo', 'Kwesi', 'Ama', 'Akosua', 'Abena',
+               'Adwoa', 'Akua', 'Yaa', 'Efua', 'Esi', 'Samuel', 'Isaac', 'Prince', 'Emmanuel', 'Daniel']
+LAST_NAMES = ['Asante', 'Mensah', 'Boateng', 'Osei', 'Adjei', 'Agyemang', 'Owusu', 'Appiah', 'Amoah',
+              'Ofori', 'Darko', 'Badu', 'Frimpong', 'Acheampong', 'Nkrumah', 'Sarpong', 'Antwi', 'Addo']
+
+def generate_synthetic_data(branches=10, customers=100000, days=180, visits_per_day=60,
+                            barbers_per_branch=4, queue_size=12, seed=42, progress=print):
+    """Bulk-generate a franchise for load testing: branches, barbers, customers and visit history.
+
+    Branch codes are bench01, bench02, ...; each gets a bench01_admin / bench01123
+    login. Visits follow ARRIVAL_CURVE and WEEKDAY_FACTOR, repeat customers are
+    skewed towards a loyal core, and the revenue rollup is rebuilt at the end.
+    """
+    rng = random.Random(seed)
+    batch_size = 10000
+    
+    if not Service.query.first():
         create_sample_data()
-        update_existing_customers_branch()
+    services = [s for s in Service.query.filter_by(is_active=True).all()]
+    
+    # Branches, barbers and branch logins
+    branch_codes = [f'bench{index:02d}' for index in range(1, branches + 1)]
+    for index, code in enumerate(branch_codes, start=1):
+        if not Branch.query.filter_by(code=code).first():
+            db.session.add(Branch(code=code, name=f'Bench Branch {index}', address=f'{index} Benchmark Road, Accra',
+                                  phone=f'0302-{index:03d}-000'))
+            for barber_index in range(barbers_per_branch):
+                db.session.add(Barber(name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {barber_index + 1}',
+                                      branch=code))
+        if not User.query.filter_by(username=f'{code}_admin').first():
+            db.session.add(User(username=f'{code}_admin', password=generate_password_hash(f'{code}123'),
+                                role='branch_admin', branch=code))
+    bump_catalog_version()
+    db.session.commit()
+    barbers = {}
+    for barber in Barber.query.filter(Barber.branch.in_(branch_codes)).all():
+        barbers.setdefault(barber.branch, []).append(barber.id)
+    
+    # Customers, each registered at a home branch
+    start_id = (db.session.query(func.max(Customer.id)).scalar() or 0) + 1
+    home_branch = {}
+    first_day = business_today() - timedelta(days=days)
+    rows = []
+    for offset in range(customers):
+        customer_id = start_id + offset
+        home_branch[customer_id] = rng.choice(branch_codes)
+        rows.append({
+            'id': customer_id,
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'phone': f'09{customer_id:08d}',
+            'email': f'customer{customer_id}@example.com' if rng.random() < 0.4 else None,
+            'status': 'registered',
+            'branch': home_branch[customer_id],
+            'total_visits': 0,
+            'created_at': datetime.combine(first_day, datetime.min.time())
+        })
+        if len(rows) >= batch_size:
+            db.session.execute(Customer.__table__.insert(), rows)
+            db.session.commit()
+            rows = []
+    if rows:
+        db.session.execute(Customer.__table__.insert(), rows)
+        db.session.commit()
+    progress(f"  {customers} customers")
+    
+    # Visit history: a loyal core of customers accounts for most repeat visits
+    customer_ids = list(home_branch)
+    hours = list(ARRIVAL_CURVE)
+    hour_weights = [ARRIVAL_CURVE[hour] for hour in hours]
+    visits = []
+    visit_count = 0
+    for day_offset in range(days):
+        business_date = first_day + timedelta(days=day_offset)
+        for code in branch_codes:
+            arrivals = max(0, int(rng.gauss(visits_per_day * WEEKDAY_FACTOR[business_date.weekday()], visits_per_day * 0.15)))
+            for hour in rng.choices(hours, weights=hour_weights, k=arrivals):
+                service = rng.choice(services)
+                arrived = datetime.combine(business_date, datetime.min.time()) + timedelta(hours=hour, minutes=rng.random() * 60)
+                assigned = arrived + timedelta(minutes=rng.expovariate(1 / 12))
+                duration = max(5.0, rng.gauss(service.duration, service.duration * 0.2))
+                visits.append({
+                    'customer_id': customer_ids[int(len(customer_ids) * rng.random() ** 2)],
+                    'service_id': service.id,
+                    'barber_id': rng.choice(barbers[code]),
+                    'branch': code,
+                    'visit_date': arrived,
+                    'assigned_at': assigned,
+                    'completed_at': assigned + timedelta(minutes=duration),
+                    'price_paid': service.price,
+                    'duration_minutes': round(duration, 1)
+                })
+                if len(visits) >= batch_size:
+                    db.session.execute(CustomerVisit.__table__.insert(), visits)
+                    db.session.commit()
+                    visit_count += len(visits)
+                    visits = []
+        if (day_offset + 1) % 30 == 0:
+            progress(f"  {day_offset + 1}/{days} days, {visit_count + len(visits)} visits")
+    if visits:
+        db.session.execute(CustomerVisit.__table__.insert(), visits)
+        db.session.commit()
+        visit_count += len(visits)
+    progress(f"  {visit_count} visits")
+    
+    # Customer visit counters from the history
+    db.session.execute(db.text("""
+        UPDATE customer SET
+            total_visits = (SELECT COUNT(*) FROM customer_visit v WHERE v.customer_id = customer.id),
+            last_visit = (SELECT MAX(v.visit_date) FROM customer_visit v WHERE v.customer_id = customer.id),
+            status = CASE WHEN EXISTS (SELECT 1 FROM customer_visit v WHERE v.customer_id = customer.id)
+                          THEN 'completed' ELSE status END
+        WHERE customer.id >= :start_id
+    """), {'start_id': start_id})
+    db.session.commit()
+    
+    # A live queue for today at every branch
+    now = datetime.utcnow()
+    queued = customer_ids[-(queue_size * len(branch_codes)):] if queue_size else []
+    for index, customer_id in enumerate(queued):
+        customer = db.session.get(Customer, customer_id)
+        customer.add_to_queue(rng.choice(services).id, branch_codes[index % len(branch_codes)])
+        customer.created_at = customer.last_visit = now - timedelta(minutes=queue_size - index // len(branch_codes))
+    db.session.commit()
+    
+    rebuild_revenue_rollup(first_day, business_today())
+    rebuild_duration_stats()
+    queue_store.invalidate()
+    broadcast_invalidation('queue')
+    broadcast_invalidation('revenue')
+    return {'branches': len(branch_codes), 'customers': customers, 'visits': visit_count, 'queued': len(queued)}
 
-        try:
-            expired_count = cleanup_expired_resets()
-            if expired_count > 0:
-                print(f"Cleaned up {expired_count} expired password reset tokens")
-        except Exception as e:
-            print(f"Could not clean up expired tokens: {e}")
+@app.cli.command('generate-data')
+@click.option('--branches', default=10, show_default=True)
+@click.option('--customers', default=100000, show_default=True)
+@click.option('--days', default=180, show_default=True, help='Days of visit history.')
+@click.option('--visits-per-day', default=60, show_default=True, help='Average visits per branch per day.')
+@click.option('--barbers', 'barbers_per_branch', default=4, show_default=True)
+@click.option('--queue-size', default=12, show_default=True, help='Customers waiting today at each branch.')
+@click.option('--seed', default=42, show_default=True)
+def generate_data_command(branches, customers, days, visits_per_day, barbers_per_branch, queue_size, seed):
+    """Generate a synthetic franchise for benchmarking (do not run against production)"""
+    started = time.monotonic()
+    summary = generate_synthetic_data(branches, customers, days, visits_per_day, barbers_per_branch, queue_size, seed)
+    print(f"✅ Generated {summary['branches']} branches, {summary['customers']} customers, "
+          f"{summary['visits']} visits and {summary['queued']} queued customers in {time.monotonic() - started:.0f}s")
+
+with app.app_context():
+    ensure_schema()
+
+if __name__ == '__main__':
+    with app.app_context():
+        # Development convenience: seed an empty database
+        if not User.query.first():
+            create_sample_data()
+        queue_store.rebuild_all()
+        email_sender.start()
         
         print("✅ TrimQ System Ready!")
         print("\n📋 Default Login Accounts:")
@@ -2310,4 +5429,4 @@ if __name__ == '__main__':
         print("🕐 Hourly Trends: Live hourly revenue tracking")
         print("\n🌐 Access: http://127.0.0.1:5000")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
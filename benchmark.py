@@ -0,0 +1,201 @@
+"""
+TrimQ endpoint latency benchmark.
+
+Replays GET requests against the configured database through the Flask test
+client and reports p50/p95/p99 latency and SQL query counts per endpoint.
+
+    flask --app app generate-data --branches 10 --customers 100000
+    python benchmark.py --requests 50 --output bench-before.json
+    python benchmark.py --requests 50 --output bench-after.json --compare bench-before.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event as sa_event, func
+from sqlalchemy.engine import Engine
+
+import app as trimq
+
+app, db = trimq.app, trimq.db
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def pick_targets(branch_code):
+    """Find a branch, customer and search term that exist in the current database"""
+    with app.app_context():
+        if not branch_code:
+            branch_code = db.session.query(trimq.Customer.branch).filter(
+                trimq.Customer.status.in_(['waiting', 'assigned'])
+            ).group_by(trimq.Customer.branch).order_by(func.count().desc()).limit(1).scalar() or 'main'
+        row = trimq.Customer.query.filter_by(branch=branch_code).order_by(trimq.Customer.id.desc()).first() \
+            or trimq.Customer.query.first()
+        customer = {'id': row.id, 'name': row.name, 'phone': row.phone} if row else None
+        counts = {
+            'branches': trimq.Branch.query.count(),
+            'customers': trimq.Customer.query.count(),
+            'visits': trimq.CustomerVisit.query.count(),
+        }
+    return branch_code, customer, counts
+
+
+def build_endpoints(branch_code, customer):
+    today = date.today()
+    month_start = (today - timedelta(days=29)).isoformat()
+    search_term = customer['name'].split()[-1] if customer else 'Mensah'
+    endpoints = [
+        ('index', '/'),
+        ('queue_manage', f'/queue/{branch_code}'),
+        ('public_display', f'/display/{branch_code}'),
+        ('revenue_report', '/revenue-report'),
+        ('revenue_report_30_days', f'/revenue-report?start={month_start}&end={today.isoformat()}'),
+        ('manage_customers', '/customers'),
+        ('manage_customers_search', f'/customers?search={search_term}'),
+        ('api_customers_search', f'/api/customers/search?q={search_term}'),
+        ('api_revenue_branch', f'/api/revenue/{branch_code}'),
+        ('api_revenue_all', '/api/revenue/all'),
+        ('api_revenue_series_30_days', f'/api/revenue/series?start={month_start}&end={today.isoformat()}'),
+        ('api_service_breakdown', '/api/service-breakdown/all'),
+        ('api_hourly_trend', f'/api/hourly-trend/{branch_code}'),
+        ('api_franchise_snapshot', '/api/franchise/snapshot'),
+    ]
+    if customer:
+        endpoints += [
+            ('api_get_customer', f"/api/customers/{customer['id']}"),
+            ('api_check_duplicate', f"/api/check_duplicate/{branch_code}?phone={customer['phone']}"),
+        ]
+    return endpoints
+
+
+def run(endpoints, username, password, requests_per_endpoint, warmup):
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    if response.status_code != 302:
+        sys.exit(f'Login as {username} failed (status {response.status_code})')
+
+    query_count = [0]
+    request_thread = threading.get_ident()
+
+    def count_query(*args):
+        # Every engine (read-only views use the read engine), but not background threads like the cache bus
+        if threading.get_ident() == request_thread:
+            query_count[0] += 1
+
+    sa_event.listen(Engine, 'before_cursor_execute', count_query)
+
+    results = {}
+    for name, url in endpoints:
+        for _ in range(warmup):
+            client.get(url)
+        timings = []
+        queries = []
+        statuses = set()
+        for _ in range(requests_per_endpoint):
+            query_count[0] = 0
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+            queries.append(query_count[0])
+            statuses.add(response.status_code)
+        timings.sort()
+        queries.sort()
+        results[name] = {
+            'url': url,
+            'status': sorted(statuses),
+            'requests': requests_per_endpoint,
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'mean_ms': round(sum(timings) / len(timings), 2),
+            'queries_p50': percentile(queries, 0.50),
+            'queries_max': queries[-1],
+        }
+        print(f"{name:<30} {results[name]['p50_ms']:>9.1f} {results[name]['p95_ms']:>9.1f} "
+              f"{results[name]['p99_ms']:>9.1f} {results[name]['queries_p50']:>8} {results[name]['queries_max']:>8}"
+              f"  {','.join(str(s) for s in sorted(statuses))}")
+
+    sa_event.remove(Engine, 'before_cursor_execute', count_query)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)['endpoints']
+    print(f"\nCompared with {baseline_path} (p50 / p95 ms, queries p50):")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        print(f"{name:<30} {before['p50_ms']:>8.1f} -> {current['p50_ms']:<8.1f} "
+              f"{before['p95_ms']:>8.1f} -> {current['p95_ms']:<8.1f} "
+              f"{before['queries_p50']:>4} -> {current['queries_p50']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TrimQ endpoints with the Flask test client')
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per endpoint first')
+    parser.add_argument('--branch', help='branch to benchmark (default: the one with the longest queue)')
+    parser.add_argument('--username', default='master_admin')
+    parser.add_argument('--password', default='master123')
+    parser.add_argument('--only', action='append', help='benchmark only these endpoint names (repeatable)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='print deltas against an earlier JSON result file')
+    args = parser.parse_args()
+
+    branch_code, customer, counts = pick_targets(args.branch)
+    endpoints = build_endpoints(branch_code, customer)
+    if args.only:
+        endpoints = [(name, url) for name, url in endpoints if name in args.only]
+
+    with app.app_context():
+        database = db.engine.url.render_as_string(hide_password=True)
+    print(f"Database: {database}, {counts['branches']} branches, {counts['customers']} customers, {counts['visits']} visits; "
+          f"branch {branch_code}")
+    print(f"{'endpoint':<30} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'max q':>8}  status")
+    results = run(endpoints, args.username, args.password, args.requests, args.warmup)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'database': database,
+            'branch': branch_code,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            **counts,
+        },
+        'endpoints': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
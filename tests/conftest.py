@@ -0,0 +1,73 @@
+import atexit
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.py reads its configuration and migrates the database at import time, so point it at a
+# throwaway database first. The long cache bus interval keeps this process's listener from
+# evicting anything during a test: only what a test polls explicitly is applied.
+_database_dir = tempfile.mkdtemp(prefix='trimq-tests-')
+atexit.register(shutil.rmtree, _database_dir, ignore_errors=True)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_database_dir, 'trimq.db')
+os.environ['CACHE_BUS_POLL_MS'] = '60000'
+os.environ['CACHE_BUS_MAX_POLL_MS'] = '60000'
+sys.path.insert(0, ROOT)
+
+import app as trimq  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    trimq.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with trimq.app.app_context():
+        trimq.create_sample_data()
+        trimq.queue_store.rebuild_all()
+    return trimq.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def staff_client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'master_admin', 'password': 'master123'})
+    assert response.status_code == 302
+    return client
+
+
+# Runs in a separate Python process on the same database, like a second gunicorn worker
+_OTHER_WORKER_JOIN = '''
+import sys
+import app as trimq
+
+name, phone, branch_code = sys.argv[1:4]
+with trimq.app.app_context():
+    customer = trimq.Customer(name=name, phone=phone)
+    trimq.db.session.add(customer)
+    trimq.db.session.flush()
+    customer.add_to_queue(trimq.Service.query.first().id, branch_code)
+    trimq.db.session.commit()
+    print(customer.id)
+'''
+
+
+@pytest.fixture
+def other_worker_join(app):
+    """Add a customer to a branch's queue from another process; returns the customer id"""
+    def join(name, phone, branch_code):
+        result = subprocess.run(
+            [sys.executable, '-c', _OTHER_WORKER_JOIN, name, phone, branch_code],
+            cwd=ROOT, env=os.environ.copy(), capture_output=True, text=True, timeout=60
+        )
+        assert result.returncode == 0, result.stderr
+        return int(result.stdout.strip().splitlines()[-1])
+    return join
@@ -0,0 +1,63 @@
+import app as trimq
+
+
+def waiting_names(branch_code):
+    return [entry.name for entry in trimq.queue_store.snapshot(branch_code, refresh=False)['waiting']]
+
+
+def test_other_worker_write_evicts_cached_queue(app, other_worker_join):
+    bus = trimq.CacheInvalidationBus()
+    with app.app_context():
+        bus.poll()  # takes the cursor
+        trimq.queue_store.rebuild('main')
+        assert 'Bus Other' not in waiting_names('main')
+
+        other_worker_join('Bus Other', '0271000001', 'main')
+        # Nothing has been polled yet: this worker still serves its cached copy
+        assert 'Bus Other' not in waiting_names('main')
+
+        assert bus.poll() >= 1
+        assert 'Bus Other' in waiting_names('main')
+
+
+def test_own_writes_are_not_evicted(app):
+    bus = trimq.CacheInvalidationBus()
+    with app.app_context():
+        bus.poll()
+        customer = trimq.Customer(name='Bus Own', phone='0271000002')
+        trimq.db.session.add(customer)
+        trimq.db.session.flush()
+        customer.add_to_queue(trimq.Service.query.first().id, 'downtown')
+        trimq.db.session.commit()
+
+        # Write-through already applied it, so the change log row is skipped
+        assert bus.poll() == 0
+        assert 'Bus Own' in waiting_names('downtown')
+
+
+def test_display_etag_changes_after_other_worker_write(client, other_worker_join):
+    first = client.get('/display/uptown')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    assert client.get('/display/uptown', headers={'If-None-Match': etag}).status_code == 304
+
+    other_worker_join('Etag Other', '0271000003', 'uptown')
+
+    # This process's cache bus has not polled, yet the page must not be answered from its stale copy
+    second = client.get('/display/uptown', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert 'Etag Other' in second.get_data(as_text=True)
+
+    assert client.get('/display/uptown', headers={'If-None-Match': second.headers['ETag']}).status_code == 304
+
+
+def test_queue_page_etag_is_per_user(staff_client, app):
+    first = staff_client.get('/queue/main')
+    assert first.status_code == 200
+    assert staff_client.get('/queue/main', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    other = app.test_client()
+    assert other.post('/login', data={'username': 'main_admin', 'password': 'main123'}).status_code == 302
+    assert other.get('/queue/main', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
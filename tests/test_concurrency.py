@@ -0,0 +1,94 @@
+import threading
+from datetime import datetime
+
+import app as trimq
+
+
+def run_together(app, count, work):
+    """Run work(index) on count threads released at the same moment; returns their results by index"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    errors = []
+
+    def run(index):
+        with app.app_context():
+            try:
+                barrier.wait()
+                results[index] = work(index)
+            except Exception as e:  # surfaced by the assert below
+                errors.append(e)
+                trimq.db.session.rollback()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert not errors, errors
+    return results
+
+
+def new_waiting_customer(name, phone, branch_code):
+    customer = trimq.Customer(name=name, phone=phone)
+    trimq.db.session.add(customer)
+    trimq.db.session.flush()
+    customer.add_to_queue(trimq.Service.query.first().id, branch_code)
+    trimq.db.session.commit()
+    return customer.id
+
+
+def test_concurrent_joins_get_distinct_consecutive_tickets(app):
+    with app.app_context():
+        day = trimq.business_today()
+        before = trimq.db.session.query(trimq.TicketSequence.last_number).filter_by(
+            branch='uptown', business_date=day).scalar() or 0
+
+    def join(index):
+        customer_id = new_waiting_customer(f'Ticket {index}', f'02720000{index:02d}', 'uptown')
+        return trimq.db.session.get(trimq.Customer, customer_id).ticket_number
+
+    tickets = run_together(app, 8, join)
+    assert sorted(tickets) == [trimq.format_ticket_number('uptown', before + n) for n in range(1, 9)]
+
+
+def test_concurrent_ticket_sequence_upserts(app):
+    day = datetime(2001, 1, 1).date()
+
+    def take(index):
+        number = trimq.next_ticket_sequence('downtown', day)
+        trimq.db.session.commit()
+        return number
+
+    assert sorted(run_together(app, 10, take)) == list(range(1, 11))
+
+
+def test_only_one_barber_claims_a_customer(app):
+    with app.app_context():
+        customer_id = new_waiting_customer('Claim Race', '0273000001', 'main')
+        barber_ids = [barber['id'] for barber in trimq.catalog.barbers_for('main')]
+
+    def claim(index):
+        customer = trimq.claim_customer(customer_id, barber_ids[index % len(barber_ids)], datetime.utcnow(),
+                                        require_idle_barber=False)
+        trimq.db.session.commit()
+        return customer is not None
+
+    assert sum(run_together(app, 6, claim)) == 1
+    with app.app_context():
+        assert trimq.db.session.get(trimq.Customer, customer_id).status == 'assigned'
+
+
+def test_idle_barber_takes_only_one_customer(app):
+    with app.app_context():
+        customer_ids = [new_waiting_customer(f'Chair Race {n}', f'02730001{n:02d}', 'downtown') for n in range(4)]
+        barber_id = trimq.catalog.barbers_for('downtown')[0]['id']
+        assert not trimq.Customer.query.filter_by(barber_id=barber_id, status='assigned').count()
+
+    def claim(index):
+        customer = trimq.claim_customer(customer_ids[index], barber_id, datetime.utcnow())
+        trimq.db.session.commit()
+        return customer is not None
+
+    assert sum(run_together(app, 4, claim)) == 1
+    with app.app_context():
+        assert trimq.Customer.query.filter_by(barber_id=barber_id, status='assigned').count() == 1